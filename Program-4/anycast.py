@@ -0,0 +1,120 @@
+import heapq
+from collections import Counter
+
+INFINITY = float('inf')
+
+
+class SinkRouting:
+    # Distance (in hops) to the nearest sink, that sink and the next hop towards it, for
+    # every node of `graph`, from a multi-source Dijkstra over all sinks. Adding a sink or
+    # a link only relaxes the nodes that get closer; removing one only recomputes the
+    # nodes whose route used it (its subtree in the shortest-path forest).
+    def __init__(self, graph, sinks=()):
+        self.graph = graph
+        self.sinks = set(sinks)
+        self.distance = {}
+        self.next_hop = {}  # node -> next hop (None for a sink)
+        self.sink = {}  # node -> nearest sink
+        self.children = {}  # node -> nodes using it as next hop
+        self.updates = 0  # Route entries written, to measure the cost of the updates
+        self.rebuild()
+
+    def rebuild(self):
+        self.distance.clear()
+        self.next_hop.clear()
+        self.sink.clear()
+        self.children.clear()
+        self.propagate([(0, sink, sink, None) for sink in self.sinks])
+
+    def set_route(self, node, distance, sink, next_hop):
+        self.clear_route(node)
+        self.distance[node] = distance
+        self.sink[node] = sink
+        self.next_hop[node] = next_hop
+        if next_hop is not None:
+            self.children.setdefault(next_hop, set()).add(node)
+        self.updates += 1
+
+    def clear_route(self, node):
+        if node not in self.distance:
+            return
+        old_hop = self.next_hop.pop(node)
+        if old_hop is not None:
+            self.children[old_hop].discard(node)
+        del self.distance[node]
+        del self.sink[node]
+
+    def propagate(self, heap):
+        # heap entries: (distance, node, sink, next hop)
+        heapq.heapify(heap)
+        while heap:
+            distance, node, sink, next_hop = heapq.heappop(heap)
+            if distance >= self.distance.get(node, INFINITY):
+                continue
+            self.set_route(node, distance, sink, next_hop)
+            for neighbor in self.graph.neighbors(node):
+                if distance + 1 < self.distance.get(neighbor, INFINITY):
+                    heapq.heappush(heap, (distance + 1, neighbor, sink, node))
+
+    def repair(self, roots):
+        # Forget the routes of `roots` and of every node routing through them, then
+        # recompute those routes from the neighbours that kept a valid one
+        affected = set()
+        stack = [root for root in roots if root in self.distance]
+        while stack:
+            node = stack.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            stack.extend(self.children.get(node, ()))
+        for node in affected:
+            self.clear_route(node)
+        heap = []
+        for node in affected:
+            if node in self.sinks:
+                heap.append((0, node, node, None))
+                continue
+            for neighbor in self.graph.neighbors(node):
+                if neighbor in self.distance:
+                    heap.append((self.distance[neighbor] + 1, node, self.sink[neighbor], neighbor))
+        self.propagate(heap)
+
+    def add_sink(self, sink):
+        self.sinks.add(sink)
+        self.propagate([(0, sink, sink, None)])
+
+    def remove_sink(self, sink):
+        self.sinks.discard(sink)
+        self.repair([sink])
+
+    def add_link(self, node1, node2):
+        # Call after the link is added to the graph
+        heap = []
+        for a, b in ((node1, node2), (node2, node1)):
+            if a in self.distance and self.distance[a] + 1 < self.distance.get(b, INFINITY):
+                heap.append((self.distance[a] + 1, b, self.sink[a], a))
+        self.propagate(heap)
+
+    def remove_link(self, node1, node2):
+        # Call after the link is removed from the graph
+        roots = [a for a, b in ((node1, node2), (node2, node1)) if self.next_hop.get(a) == b]
+        if roots:
+            self.repair(roots)
+
+    def report(self, delivered=None):
+        # Per sink: nodes it serves, their mean distance and the packets it received
+        served = Counter()
+        total_distance = Counter()
+        for node, sink in self.sink.items():
+            if node != sink:
+                served[sink] += 1
+                total_distance[sink] += self.distance[node]
+        delivered = delivered or {}
+        return {
+            sink: {
+                'nodes_served': served[sink],
+                'average_hops': total_distance[sink] / served[sink] if served[sink] else None,
+                'packets_delivered': delivered.get(sink, 0),
+            }
+            for sink in sorted(self.sinks)
+        }
@@ -1,7 +1,15 @@
+import os
+import sys
 import click
 import configparser
 from network import Network
-from node import Node
+from traces import TraceSource
+from emulation import run_emulation
+from parallel import Topology, run_partitioned
+
+# results_store.py is shared with the programs at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from results_store import ResultsStore
 
 def read_config(file_path):
     config = configparser.ConfigParser()
@@ -15,6 +23,11 @@ def read_config(file_path):
     }
     return simulation_config
 
+# Options of the step-by-step simulation that the partitioned kernel (--workers) does not model
+NOT_PARTITIONED = ('protocol', 'mobility', 'route_discovery', 'trace', 'ttl', 'link_capacity', 'emulate')
+# Options of the step-by-step simulation that the UDP emulation (--emulate) does not model
+NOT_EMULATED = ('steps', 'mobility', 'trace', 'link_capacity')
+
 @click.command()
 @click.option('--config', type=click.Path(), help='Path to the configuration file')
 @click.option('--protocol', type=str, default='AODV', help='Routing protocol (AODV/DSR)')
@@ -22,7 +35,43 @@ def read_config(file_path):
 @click.option('--nodes', type=int, default=5, help='Number of nodes in the network')
 @click.option('--links', type=int, default=5, help='Number of random links between nodes')
 @click.option('--topology', type=str, default='cluster', help='Network topology (grid/random/cluster)')
-def run_simulation(config, protocol, steps, nodes, links, topology):
+@click.option('--mobility', type=click.Choice(['none', 'waypoint', 'group']), default='none', help='Node mobility model')
+@click.option('--speed', type=float, default=2.0, help='Maximum node speed per step (with --mobility)')
+@click.option('--radio-range', type=float, default=20.0, help='Radio range of the nodes (with --mobility)')
+@click.option('--sinks', type=click.IntRange(min=1), default=1, help='Number of base stations; with more than one, data goes to the nearest')
+@click.option('--route-discovery', is_flag=True, help='Discover shortest-path routes instead of forwarding randomly')
+@click.option('--trace', type=click.Path(exists=True), help='Replay sensor readings from a CSV or binary trace file')
+@click.option('--trace-step', type=float, default=1.0, help='Seconds of the trace replayed per simulation step')
+@click.option('--emulate', is_flag=True, help='Run every node as an asyncio task exchanging UDP packets on localhost')
+@click.option('--duration', type=float, default=10.0, help='Seconds to run the emulation (with --emulate)')
+@click.option('--link-delay', type=float, default=0.0, help='Delay in seconds added to every frame (with --emulate)')
+@click.option('--link-jitter', type=float, default=0.0, help='Random extra delay of up to this many seconds (with --emulate)')
+@click.option('--link-loss', type=float, default=0.0, help='Probability of losing a frame (with --emulate)')
+@click.option('--send-interval', type=float, default=1.0, help='Seconds between two readings of a sensor (with --emulate)')
+@click.option('--ttl', type=click.IntRange(0, 255), default=64, help='Hops a data packet may take before it is dropped (at most 255)')
+@click.option('--link-capacity', type=int, help='Packets a link carries per step (default: unlimited)')
+@click.option('--workers', type=click.IntRange(min=0), default=0, help='Step the network with this many processes (fixed nearest-sink routes)')
+@click.option('--results', type=click.Path(), help='Record the run in this SQLite results database')
+@click.option('--visualize/--no-visualize', default=True, help='Save a picture of the network (needs matplotlib)')
+def run_simulation(config, protocol, steps, nodes, links, topology, mobility, speed, radio_range, sinks, route_discovery, trace, trace_step,
+                   emulate, duration, link_delay, link_jitter, link_loss, send_interval, ttl, link_capacity, workers, results, visualize):
+    if workers:
+        context = click.get_current_context()
+        given = [name for name in NOT_PARTITIONED
+                 if context.get_parameter_source(name) != click.core.ParameterSource.DEFAULT]
+        if given:
+            options = ', '.join('--' + name.replace('_', '-') for name in given)
+            raise click.UsageError(f"{options} cannot be used with --workers: partitioned runs use fixed "
+                                   f"nearest-sink routes without mobility, traces, TTL or link capacity")
+    elif emulate:
+        context = click.get_current_context()
+        given = [name for name in NOT_EMULATED
+                 if context.get_parameter_source(name) != click.core.ParameterSource.DEFAULT]
+        if given:
+            options = ', '.join('--' + name.replace('_', '-') for name in given)
+            raise click.UsageError(f"{options} cannot be used with --emulate: the emulation runs for --duration "
+                                   f"seconds on a fixed topology with random readings and unlimited links")
+
     if config:
         config_values = read_config(config)
         protocol = config_values['protocol']
@@ -34,15 +83,80 @@ def run_simulation(config, protocol, steps, nodes, links, topology):
     net = Network()
     net.generate_topology(topology, nodes, links)
     
-    base_station = Node(0, (50, 50), role='base_station')
-    net.add_node(base_station)
+    net.add_base_stations(sinks, radio_range)
+    net.route_discovery = route_discovery
+    net.ttl = ttl
+    net.link_capacity = link_capacity
+    if mobility != 'none':
+        net.enable_mobility(mobility, radio_range, speed=(speed / 4, speed))
+    if sinks > 1:
+        net.enable_anycast()
+
+    store = ResultsStore(results) if results else None
+    if store and workers:
+        parameters = dict(steps=steps, nodes=nodes, links=links, topology=topology, radio_range=radio_range,
+                          sinks=sinks, workers=workers)
+        run_id = store.start_run('cli', parameters, 'PARTITIONED', nodes)
+    elif store and emulate:
+        parameters = dict(protocol=protocol, nodes=nodes, links=links, topology=topology, radio_range=radio_range,
+                          sinks=sinks, route_discovery=route_discovery, emulate=emulate, ttl=ttl, duration=duration,
+                          link_delay=link_delay, link_jitter=link_jitter, link_loss=link_loss,
+                          send_interval=send_interval)
+        run_id = store.start_run('cli', parameters, protocol.upper(), nodes)
+    elif store:
+        parameters = dict(protocol=protocol, steps=steps, nodes=nodes, links=links, topology=topology,
+                          mobility=mobility, speed=speed, radio_range=radio_range, sinks=sinks,
+                          route_discovery=route_discovery, trace=trace, trace_step=trace_step,
+                          ttl=ttl, link_capacity=link_capacity)
+        run_id = store.start_run('cli', parameters, protocol.upper(), nodes)
+
+    if emulate:
+        report = run_emulation(net, duration, link_delay, link_jitter, link_loss, send_interval)
+        print(f"Emulation: {report}")
+        if store:
+            store.finish_run(run_id, report)
+            store.close()
+        return
+
+    if workers:
+        report, energy = run_partitioned(Topology.from_network(net), steps, workers)
+        print(f"Partitioned run: {report}")
+        if store:
+            store.finish_run(run_id, report)
+            store.close()
+        return
+
+    traffic = TraceSource(trace, trace_step) if trace else None
+    on_step = (lambda step: store.add_metrics(run_id, step, net.step_metrics())) if store else None
 
     if protocol.upper() == 'AODV':
-        net.run_aodv_simulation(steps)
+        net.run_aodv_simulation(steps, traffic, on_step)
     elif protocol.upper() == 'DSR':
-        net.run_dsr_simulation(steps)
-    
-    net.visualize()
+        net.run_dsr_simulation(steps, traffic, on_step)
+
+    summary = {'packets': net.latency_report(), 'busiest_links': net.link_report()}
+    print(f"Packets: {summary['packets']}")
+    print("Busiest links:")
+    for entry in summary['busiest_links']:
+        print(f"  {entry}")
+    if sinks > 1:
+        summary['sinks'] = net.sink_report()
+        print(f"Sinks: {summary['sinks']}")
+    if traffic:
+        summary['trace'] = {'replayed': traffic.replayed, 'skipped': traffic.skipped}
+        print(f"Trace: {traffic.replayed} readings replayed, {traffic.skipped} skipped (unknown node ids, base stations or nodes without energy)")
+
+    if net.mobility:
+        summary['mobility'] = net.mobility.report()
+        print(f"Mobility: {summary['mobility']}")
+
+    if store:
+        store.add_packets(run_id, net.delivered)
+        store.finish_run(run_id, summary)
+        store.close()
+
+    if visualize:
+        net.visualize()
 
 if __name__ == '__main__':
     run_simulation()
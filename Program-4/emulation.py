@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import os
+import random
+import struct
+from packet import DATA, RREQ, RREP, ANY_SINK, PacketPool, FRAME, encode, decode
+from traces import pack_reading
+
+LOCALHOST = '127.0.0.1'
+NEXT_HOP = struct.Struct('<I')  # First field of every frame
+
+
+def raise_open_file_limit():
+    # Every emulated node has its own socket, so large networks need many file descriptors
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+class Relay(asyncio.DatagramProtocol):
+    # Forwards frames between node sockets, only over links of the neighbour graph,
+    # after `delay` (+ up to `jitter`) seconds and losing each frame with probability `loss`.
+    def __init__(self, graph, delay=0.0, jitter=0.0, loss=0.0):
+        self.graph = graph
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.addresses = {}  # node id -> socket address
+        self.node_of = {}  # socket address -> node id
+        self.forwarded = 0
+        self.lost = 0
+        self.rejected = 0  # Frames to a node that is not a neighbour of the sender
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def register(self, node_id, address):
+        self.addresses[node_id] = address
+        self.node_of[address] = node_id
+
+    def datagram_received(self, data, addr):
+        sender = self.node_of.get(addr)
+        if sender is None or len(data) < FRAME.size:
+            self.rejected += 1
+            return
+        next_hop = NEXT_HOP.unpack_from(data)[0]
+        if next_hop not in self.addresses or not self.graph.has_edge(sender, next_hop):
+            self.rejected += 1
+            return
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return
+        self.forwarded += 1
+        delay = self.delay + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, data, self.addresses[next_hop])
+        else:
+            self.transport.sendto(data, self.addresses[next_hop])
+
+
+class NodeEndpoint(asyncio.DatagramProtocol):
+    def __init__(self, emulation):
+        self.emulation = emulation
+        self.inbox = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        try:
+            next_hop, packet = decode(data, self.emulation.packet_pool)
+        except struct.error:
+            self.emulation.malformed += 1
+            return
+        self.inbox.put_nowait(packet)
+
+
+class NodeLink:
+    # The `network` seen by the protocol code of one emulated node: topology queries go to
+    # the emulation, and every send is serialized and written to the node's own UDP socket.
+    def __init__(self, emulation, node, transport):
+        self.emulation = emulation
+        self.node = node
+        self.transport = transport
+
+    def __getattr__(self, name):
+        return getattr(self.emulation, name)
+
+    def send_frame(self, neighbor, packet):
+        self.transport.sendto(encode(packet, neighbor.node_id), self.emulation.relay_address)
+        self.emulation.frames_sent += 1
+
+    def send_data(self, neighbor, packet):
+        self.send_frame(neighbor, packet)
+        self.emulation.release(packet)
+
+    def send_rreq(self, neighbor, rreq):
+        self.send_frame(neighbor, rreq)
+        self.emulation.release(rreq)
+
+    def send_rrep(self, neighbor, rrep):
+        self.send_frame(neighbor, rrep)
+
+
+class Emulation:
+    # Runs every node of `network` as an asyncio task bound to its own localhost UDP socket.
+    # Packets travel as bytes through a Relay that enforces the neighbour graph.
+    def __init__(self, network, delay=0.0, jitter=0.0, loss=0.0, send_interval=1.0):
+        self.network = network
+        self.node_mapping = network.node_mapping
+        self.route_discovery = network.route_discovery
+        self.sink_routing = network.sink_routing
+        self.sink_load = {}
+        self.relay = Relay(network.graph, delay, jitter, loss)
+        self.relay_address = None
+        self.send_interval = send_interval
+        self.packet_pool = PacketPool()
+        self.loop = None
+        self.links = {}
+        self.sent = 0
+        self.frames_sent = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.expired = 0  # Data packets dropped when their TTL ran out
+        self.latencies = []  # End-to-end latency in seconds of each delivered data packet
+        self.hops = []
+
+    # Topology and routing queries of the protocol code
+    def get_neighbors(self, node):
+        return self.network.get_neighbors(node)
+
+    def discover_route(self, source_id, destination_id):
+        return self.network.discover_route(source_id, destination_id)
+
+    def new_packet(self, kind, source, destination_id, payload=b''):
+        return self.packet_pool.acquire(kind, source.node_id, destination_id, source.next_seq(),
+                                        self.loop.time(), payload, self.network.ttl)
+
+    def release(self, packet):
+        self.packet_pool.release(packet)
+
+    def copy_packet(self, packet):
+        return self.packet_pool.copy(packet)
+
+    def flood_rreqs(self):
+        # Emulated RREQs are already on their way through the relay
+        pass
+
+    def deliver(self, packet, node):
+        if packet.kind == DATA:
+            self.latencies.append(self.loop.time() - packet.created_at)
+            self.hops.append(packet.hop_count)
+            if node.role == 'base_station':
+                self.sink_load[node.node_id] = self.sink_load.get(node.node_id, 0) + 1
+        self.release(packet)
+
+    def drop(self, packet):
+        self.dropped += 1
+        self.release(packet)
+
+    def expire(self, packet):
+        self.expired += 1
+        self.release(packet)
+
+    def reserve_link(self, sender, recipient):
+        # Emulated links are only limited by the relay
+        return True
+
+    async def start(self):
+        raise_open_file_limit()
+        self.loop = asyncio.get_running_loop()
+        relay_transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: self.relay, local_addr=(LOCALHOST, 0))
+        self.relay_address = relay_transport.get_extra_info('sockname')
+        endpoints = {}
+        for node in self.node_mapping.values():
+            transport, endpoint = await self.loop.create_datagram_endpoint(
+                lambda: NodeEndpoint(self), local_addr=(LOCALHOST, 0))
+            self.relay.register(node.node_id, transport.get_extra_info('sockname'))
+            self.links[node.node_id] = NodeLink(self, node, transport)
+            endpoints[node.node_id] = endpoint
+        return endpoints
+
+    async def run_node(self, node, endpoint):
+        link = self.links[node.node_id]
+        while True:
+            packet = await endpoint.inbox.get()
+            if packet.kind == DATA:
+                node.queue_data(packet)
+                node.process_data_queue(link)
+            elif packet.kind == RREQ:
+                node.receive_rreq(link, packet)
+                self.release(packet)
+            elif packet.kind == RREP:
+                node.receive_rrep(link, packet)
+
+    async def run_sensor(self, node, destination_id):
+        link = self.links[node.node_id]
+        # Random start offset so that the sensors do not all send at the same moment
+        await asyncio.sleep(random.uniform(0, self.send_interval))
+        while True:
+            if node.energy > 0:
+                payload = pack_reading(self.loop.time(), node.node_id, random.uniform(15, 35))
+                node.queue_data(self.new_packet(DATA, node, destination_id, payload))
+                self.sent += 1
+                node.process_data_queue(link)
+            await asyncio.sleep(self.send_interval)
+
+    async def run(self, duration):
+        endpoints = await self.start()
+        destination_id = ANY_SINK if self.sink_routing else self.network.get_base_station().node_id
+        tasks = [asyncio.create_task(self.run_node(node, endpoints[node_id]))
+                 for node_id, node in self.node_mapping.items()]
+        tasks += [asyncio.create_task(self.run_sensor(node, destination_id))
+                  for node in self.node_mapping.values() if node.role == 'sensor']
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for link in self.links.values():
+                link.transport.close()
+            self.relay.transport.close()
+        return self.report(duration)
+
+    def report(self, duration):
+        delivered = len(self.latencies)
+        return {
+            'nodes': len(self.node_mapping),
+            'duration': duration,
+            'sent': self.sent,
+            'delivered': delivered,
+            'delivery_ratio': delivered / self.sent if self.sent else None,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'frames_sent': self.frames_sent,
+            'frames_forwarded': self.relay.forwarded,
+            'frames_lost': self.relay.lost,
+            'frames_rejected': self.relay.rejected,
+            'average_latency': sum(self.latencies) / delivered if delivered else None,
+            'average_hops': sum(self.hops) / delivered if delivered else None,
+            'sink_load': self.sink_load,
+        }
+
+
+def run_emulation(network, duration, delay=0.0, jitter=0.0, loss=0.0, send_interval=1.0, verbose=False):
+    emulation = Emulation(network, delay, jitter, loss, send_interval)
+    if verbose:
+        return asyncio.run(emulation.run(duration))
+    # The protocol code prints every hop; with thousands of nodes that output is discarded
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return asyncio.run(emulation.run(duration))
@@ -0,0 +1,200 @@
+import math
+import random
+
+
+class RandomWaypoint:
+    def __init__(self, area, speed=(0.5, 2.0), pause=0):
+        self.area = area  # (min_x, min_y, max_x, max_y)
+        self.speed = speed
+        self.pause = pause
+        self.state = {}  # node_id -> [waypoint, speed, pause_left]
+
+    def random_point(self):
+        min_x, min_y, max_x, max_y = self.area
+        return (random.uniform(min_x, max_x), random.uniform(min_y, max_y))
+
+    def new_leg(self):
+        return [self.random_point(), random.uniform(*self.speed), self.pause]
+
+    def move(self, nodes):
+        moved = []
+        for node in nodes:
+            leg = self.state.get(node.node_id)
+            if leg is None:
+                leg = self.state[node.node_id] = self.new_leg()
+            new_position = self.advance(node.position, leg)
+            if new_position != node.position:
+                node.position = new_position
+                moved.append(node)
+        return moved
+
+    def advance(self, position, leg):
+        waypoint, speed, pause_left = leg
+        if position == waypoint:
+            if pause_left > 0:
+                leg[2] -= 1
+                return position
+            leg[:] = self.new_leg()
+            waypoint, speed = leg[0], leg[1]
+        dx, dy = waypoint[0] - position[0], waypoint[1] - position[1]
+        distance = math.hypot(dx, dy)
+        if distance <= speed:
+            return waypoint
+        return (position[0] + dx / distance * speed, position[1] + dy / distance * speed)
+
+
+class GroupMobility:
+    # Reference point group mobility: each group follows a reference point moving by
+    # random waypoint, and its members stay within `group_radius` of that point.
+    def __init__(self, area, groups, speed=(0.5, 2.0), group_radius=10.0, pause=0):
+        self.groups = [list(group) for group in groups]
+        self.group_radius = group_radius
+        self.reference = RandomWaypoint(area, speed, pause)
+        self.reference_points = {}  # group index -> position
+        self.offsets = {}  # node_id -> offset from the reference point
+
+    def random_offset(self):
+        angle = random.uniform(0, 2 * math.pi)
+        radius = random.uniform(0, self.group_radius)
+        return (radius * math.cos(angle), radius * math.sin(angle))
+
+    def move(self, nodes):
+        by_id = {node.node_id: node for node in nodes}
+        moved = []
+        for index, group in enumerate(self.groups):
+            members = [by_id[node_id] for node_id in group if node_id in by_id]
+            if not members:
+                continue
+            if index not in self.reference_points:
+                self.reference_points[index] = (sum(node.position[0] for node in members) / len(members),
+                                                sum(node.position[1] for node in members) / len(members))
+                self.reference.state[index] = self.reference.new_leg()
+            reference = self.reference.advance(self.reference_points[index], self.reference.state[index])
+            if reference == self.reference_points[index]:
+                continue  # The group is pausing
+            self.reference_points[index] = reference
+            for node in members:
+                offset = self.offsets.get(node.node_id)
+                if offset is None:
+                    offset = self.offsets[node.node_id] = self.random_offset()
+                node.position = (reference[0] + offset[0], reference[1] + offset[1])
+                moved.append(node)
+        return moved
+
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> set of node ids
+        self.positions = {}  # node_id -> position
+        self.node_cell = {}  # node_id -> (cx, cy)
+
+    def cell_of(self, position):
+        return (int(math.floor(position[0] / self.cell_size)), int(math.floor(position[1] / self.cell_size)))
+
+    def insert(self, node_id, position):
+        cell = self.cell_of(position)
+        self.cells.setdefault(cell, set()).add(node_id)
+        self.positions[node_id] = position
+        self.node_cell[node_id] = cell
+
+    def move(self, node_id, position):
+        old_cell = self.node_cell[node_id]
+        new_cell = self.cell_of(position)
+        self.positions[node_id] = position
+        if new_cell != old_cell:
+            members = self.cells[old_cell]
+            members.discard(node_id)
+            if not members:
+                del self.cells[old_cell]
+            self.cells.setdefault(new_cell, set()).add(node_id)
+            self.node_cell[node_id] = new_cell
+
+    def within(self, node_id, radius):
+        # Nodes at most `radius` (<= cell_size) away, found in the 3x3 cells around the node
+        x, y = self.positions[node_id]
+        cx, cy = self.node_cell[node_id]
+        radius_sq = radius * radius
+        found = []
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                for other in self.cells.get((i, j), ()):
+                    if other == node_id:
+                        continue
+                    ox, oy = self.positions[other]
+                    if (ox - x) ** 2 + (oy - y) ** 2 <= radius_sq:
+                        found.append(other)
+        return found
+
+
+class MobileTopology:
+    # Keeps the links of `network` equal to the pairs of nodes within `radio_range` while
+    # `model` moves the nodes. Only the neighbourhoods of the nodes that moved are recomputed.
+    def __init__(self, network, model, radio_range):
+        self.network = network
+        self.model = model
+        self.radio_range = radio_range
+        self.index = SpatialHash(radio_range)
+        self.ticks = 0
+        self.links_added = 0
+        self.links_removed = 0
+        self.nodes_moved = 0
+        self.rebuild()
+
+    def mobile_nodes(self):
+        # node_mapping holds one node per id; base stations stay where they are
+        return [node for node in self.network.node_mapping.values() if node.role != 'base_station']
+
+    def rebuild(self):
+        graph = self.network.graph
+        graph.remove_edges_from(list(graph.edges()))
+        for node in self.network.node_mapping.values():
+            self.index.insert(node.node_id, node.position)
+        for node in self.network.node_mapping.values():
+            for other in self.index.within(node.node_id, self.radio_range):
+                if node.node_id < other:
+                    graph.add_edge(node.node_id, other)
+        if self.network.sink_routing:
+            self.network.sink_routing.rebuild()
+
+    def tick(self):
+        graph = self.network.graph
+        moved = self.model.move(self.mobile_nodes())
+        for node in moved:
+            self.index.move(node.node_id, node.position)
+            graph.nodes[node.node_id]['pos'] = node.position
+
+        added = removed = 0
+        for node in moved:
+            current = set(graph.neighbors(node.node_id))
+            in_range = set(self.index.within(node.node_id, self.radio_range))
+            for other in in_range - current:
+                graph.add_edge(node.node_id, other)
+                self.network.link_added(node.node_id, other)
+                added += 1
+            for other in current - in_range:
+                graph.remove_edge(node.node_id, other)
+                self.network.link_removed(node.node_id, other)
+                removed += 1
+
+        self.ticks += 1
+        self.nodes_moved += len(moved)
+        self.links_added += added
+        self.links_removed += removed
+        return added, removed
+
+    def churn_rate(self):
+        # Links added or removed per tick
+        if not self.ticks:
+            return 0.0
+        return (self.links_added + self.links_removed) / self.ticks
+
+    def report(self):
+        return {
+            'ticks': self.ticks,
+            'nodes_moved': self.nodes_moved,
+            'links_added': self.links_added,
+            'links_removed': self.links_removed,
+            'churn_rate': self.churn_rate(),
+            'routes_invalidated': self.network.routes_invalidated,
+        }
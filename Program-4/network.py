@@ -1,14 +1,38 @@
+import math
 import random
+from collections import deque
 import networkx as nx
 import numpy as np
 from node import Node
-import matplotlib.pyplot as plt
+from mobility import RandomWaypoint, GroupMobility, MobileTopology
+from traces import pack_reading
+from packet import DATA, ANY_SINK, DEFAULT_TTL, Packet, PacketPool
+from anycast import SinkRouting
 
 class Network:
     def __init__(self):
         self.nodes = []
         self.graph = nx.Graph()
         self.node_mapping = {}
+        self.route_discovery = False  # Find shortest-path routes on demand instead of random forwarding
+        self.routes_invalidated = 0
+        self.mobility = None
+        self.packet_pool = PacketPool()  # Set to None to allocate every packet
+        self.now = 0  # Current simulation step, the clock of the packet timestamps
+        self.delivered = []  # (source id, seq, hop count, latency in steps) of each delivered data packet
+        self.dropped = 0
+        self.sink_routing = None  # Anycast routes to the nearest base station, see enable_anycast
+        self.sink_load = {}  # base station id -> data packets it received
+        self.ttl = DEFAULT_TTL  # Hops a new data packet may take
+        self.link_capacity = None  # Packets a link carries per step (both directions together), None: unlimited
+        self.rreq_queue = deque()  # (neighbour, RREQ) of the flood in progress, handled breadth first
+        self.in_transit = []  # (neighbour, packet) sent during the current step, received at its end
+        self.step_link_load = {}  # link -> packets sent over it in the current step
+        self.link_usage = {}  # link -> packets sent over it during the run
+        self.steps_run = 0
+        self.sent = 0  # Data packets created
+        self.expired = 0  # Data packets dropped when their TTL ran out
+        self.link_blocked = 0  # Times a packet waited because its link was full
 
     def add_node(self, node):
         self.nodes.append(node)
@@ -60,33 +84,251 @@ class Network:
             node1, node2 = random.sample(self.nodes, 2)
             self.add_link(node1.node_id, node2.node_id)
 
-    def run_aodv_simulation(self, steps):
+    def add_base_stations(self, count, radio_range):
+        # Spread `count` base stations on a grid over the field of the sensors, with ids
+        # after the sensor ids, each linked to the sensors within `radio_range` (at least
+        # to the nearest one)
+        sensors = [node for node in self.nodes if node.role == 'sensor']
+        min_x = min(node.position[0] for node in sensors)
+        min_y = min(node.position[1] for node in sensors)
+        width = max(node.position[0] for node in sensors) - min_x
+        height = max(node.position[1] for node in sensors) - min_y
+        columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(count / columns))
+        first_id = max(self.node_mapping) + 1
+        for k in range(count):
+            row, column = divmod(k, columns)
+            position = (min_x + (column + 0.5) * width / columns, min_y + (row + 0.5) * height / rows)
+            base_station = Node(first_id + k, position, role='base_station')
+            self.add_node(base_station)
+            distance = {node.node_id: math.dist(position, node.position) for node in sensors}
+            in_range = [node_id for node_id, d in distance.items() if d <= radio_range]
+            for node_id in in_range or [min(distance, key=distance.get)]:
+                self.add_link(base_station.node_id, node_id)
+
+    def enable_anycast(self):
+        # Sensors send their data to whichever base station is nearest (in hops), using
+        # routes kept up to date as links change
+        self.sink_routing = SinkRouting(self.graph, [node.node_id for node in self.get_base_stations()])
+
+    def enable_mobility(self, model_type, radio_range, speed=(0.5, 2.0), pause=0):
+        positions = [node.position for node in self.nodes]
+        area = (min(p[0] for p in positions), min(p[1] for p in positions),
+                max(max(p[0] for p in positions), radio_range), max(max(p[1] for p in positions), radio_range))
+        if model_type == 'waypoint':
+            model = RandomWaypoint(area, speed, pause)
+        elif model_type == 'group':
+            # One group per neighbourhood of the initial layout
+            groups = {}
+            for node in self.nodes:
+                cell = (int(node.position[0] // (radio_range * 2)), int(node.position[1] // (radio_range * 2)))
+                groups.setdefault(cell, []).append(node.node_id)
+            model = GroupMobility(area, groups.values(), speed, group_radius=radio_range / 2, pause=pause)
+        else:
+            raise ValueError(f"Unknown mobility model: {model_type}")
+        self.mobility = MobileTopology(self, model, radio_range)
+
+    def discover_route(self, source_id, destination_id):
+        # Route discovery (RREQ flood answered by an RREP along the shortest path):
+        # every node on the path learns its next hop towards the destination.
+        try:
+            path = nx.shortest_path(self.graph, source_id, destination_id)
+        except nx.NetworkXNoPath:
+            return None
+        for upstream, node_id, next_hop in zip([None] + path[:-2], path[:-1], path[1:]):
+            node = self.node_mapping[node_id]
+            node.routes[destination_id] = next_hop
+            if upstream is not None:
+                node.precursors.setdefault(destination_id, set()).add(upstream)
+        return path
+
+    def link_added(self, node1_id, node2_id):
+        if self.sink_routing:
+            self.sink_routing.add_link(node1_id, node2_id)
+
+    def link_removed(self, node1_id, node2_id):
+        self.invalidate_routes(node1_id, node2_id)
+        if self.sink_routing:
+            self.sink_routing.remove_link(node1_id, node2_id)
+
+    def invalidate_routes(self, node1_id, node2_id):
+        # Called when the link node1 - node2 breaks: drop the routes over it at both ends,
+        # then at every precursor that forwarded to them (the RERR propagation of AODV)
+        for node_id, next_hop in ((node1_id, node2_id), (node2_id, node1_id)):
+            node = self.node_mapping[node_id]
+            broken = [dest for dest, hop in node.routes.items() if hop == next_hop]
+            for dest in broken:
+                self.invalidate_route(node, dest)
+
+    def invalidate_route(self, node, destination_id):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.routes.pop(destination_id, None) is None:
+                continue
+            self.routes_invalidated += 1
+            for upstream_id in current.precursors.pop(destination_id, ()):
+                upstream = self.node_mapping[upstream_id]
+                if upstream.routes.get(destination_id) == current.node_id:
+                    stack.append(upstream)
+
+    def run_aodv_simulation(self, steps, traffic=None, on_step=None):
         for step in range(steps):
             print(f"Simulation step {step + 1}")
-            for node in self.nodes:
-                if node.role == 'sensor' and node.energy > 0:
-                    data = f"Temperature: {random.uniform(15, 35):.2f}C"
-                    node.queue_data({'destination': self.get_base_station(), 'content': data})
-                node.process_data_queue(self)
+            self.run_step(step, traffic)
+            if on_step:
+                on_step(step)
 
-    def run_dsr_simulation(self, steps):
+    def run_dsr_simulation(self, steps, traffic=None, on_step=None):
         for step in range(steps):
             print(f"Simulation step {step + 1}")
-            for node in self.nodes:
-                if node.role == 'sensor' and node.energy > 0:
-                    data = f"Temperature: {random.uniform(15, 35):.2f}C"
-                    node.queue_data({'destination': self.get_base_station(), 'content': data})
-                node.process_data_queue(self)
+            self.run_step(step, traffic)
+            if on_step:
+                on_step(step)
+
+    def run_step(self, step, traffic=None):
+        # Sensors send one random reading per step, or the readings of `traffic` (a TraceSource).
+        # Every hop takes one step: what a node sends is only received at the end of the step.
+        self.now = step
+        self.step_link_load.clear()
+        if self.mobility:
+            self.mobility.tick()
+        base_station_id = ANY_SINK if self.sink_routing else self.get_base_station().node_id
+        if traffic is not None:
+            for node, payload in traffic.payloads_for_step(step, self.node_mapping):
+                node.queue_data(self.new_packet(DATA, node, base_station_id, payload))
+        for node in self.nodes:
+            if traffic is None and node.role == 'sensor' and node.energy > 0:
+                data = pack_reading(step, node.node_id, random.uniform(15, 35))
+                node.queue_data(self.new_packet(DATA, node, base_station_id, data))
+            node.process_data_queue(self)
+        for neighbor, packet in self.in_transit:
+            neighbor.queue_data(packet)
+        self.in_transit.clear()
+        self.steps_run += 1
+
+    def new_packet(self, kind, source, destination_id, payload=b''):
+        seq = source.next_seq()
+        if kind == DATA:
+            self.sent += 1
+        if self.packet_pool is not None:
+            return self.packet_pool.acquire(kind, source.node_id, destination_id, seq, self.now, payload, self.ttl)
+        return Packet(kind, source.node_id, destination_id, seq, self.now, payload, self.ttl)
+
+    def copy_packet(self, packet):
+        if self.packet_pool is not None:
+            return self.packet_pool.copy(packet)
+        duplicate = Packet(packet.kind, packet.source, packet.destination, packet.seq, packet.created_at,
+                           packet.payload, packet.ttl)
+        duplicate.hop_count = packet.hop_count
+        return duplicate
+
+    def release(self, packet):
+        if self.packet_pool is not None:
+            self.packet_pool.release(packet)
+
+    def deliver(self, packet, node):
+        if packet.kind == DATA:
+            self.delivered.append((packet.source, packet.seq, packet.hop_count, self.now - packet.created_at))
+            if node.role == 'base_station':
+                self.sink_load[node.node_id] = self.sink_load.get(node.node_id, 0) + 1
+        self.release(packet)
+
+    def drop(self, packet):
+        self.dropped += 1
+        self.release(packet)
+
+    def expire(self, packet):
+        self.expired += 1
+        self.release(packet)
+
+    def reserve_link(self, sender, recipient):
+        # Takes one packet of the capacity of the link for this step, if any is left
+        link = (min(sender.node_id, recipient.node_id), max(sender.node_id, recipient.node_id))
+        used = self.step_link_load.get(link, 0)
+        if self.link_capacity is not None and used >= self.link_capacity:
+            self.link_blocked += 1
+            return False
+        self.step_link_load[link] = used + 1
+        self.link_usage[link] = self.link_usage.get(link, 0) + 1
+        return True
+
+    def step_metrics(self):
+        # Running totals, recorded after every step of a run
+        metrics = {
+            'sent': self.sent,
+            'delivered': len(self.delivered),
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'link_blocked': self.link_blocked,
+            'routes_invalidated': self.routes_invalidated,
+            'links': self.graph.number_of_edges(),
+        }
+        if self.mobility:
+            metrics['links_added'] = self.mobility.links_added
+            metrics['links_removed'] = self.mobility.links_removed
+        return metrics
+
+    def latency_report(self):
+        delivered = len(self.delivered)
+        latencies = sorted(record[3] for record in self.delivered)
+        return {
+            'sent': self.sent,
+            'delivered': delivered,
+            'delivery_ratio': delivered / self.sent if self.sent else None,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'in_flight': self.sent - delivered - self.dropped - self.expired,
+            'average_latency': sum(latencies) / delivered if delivered else None,
+            'p95_latency': latencies[int(0.95 * (delivered - 1))] if delivered else None,
+            'max_latency': latencies[-1] if delivered else None,
+            'average_hops': sum(record[2] for record in self.delivered) / delivered if delivered else None,
+        }
+
+    def link_report(self, top=10):
+        # The `top` busiest links: packets carried, per step and, with a link capacity, the
+        # fraction of the capacity used over the run
+        steps = self.steps_run or 1
+        report = []
+        for link, packets in sorted(self.link_usage.items(), key=lambda item: -item[1])[:top]:
+            entry = {'link': link, 'packets': packets, 'per_step': packets / steps}
+            if self.link_capacity:
+                entry['utilisation'] = packets / (self.link_capacity * steps)
+            report.append(entry)
+        return report
+
+    def sink_report(self):
+        # Per base station: sensors it is nearest to, their mean hop distance and the data it received
+        if self.sink_routing:
+            return self.sink_routing.report(self.sink_load)
+        return {node.node_id: {'packets_delivered': self.sink_load.get(node.node_id, 0)}
+                for node in self.get_base_stations()}
 
     def get_base_station(self):
         return next(node for node in self.nodes if node.role == 'base_station')
 
+    def get_base_stations(self):
+        return [node for node in self.node_mapping.values() if node.role == 'base_station']
+
     def get_neighbors(self, node):
         neighbors_ids = list(self.graph.neighbors(node.node_id))
         return [self.node_mapping[n_id] for n_id in neighbors_ids]
 
+    def send_data(self, neighbor, packet):
+        self.in_transit.append((neighbor, packet))
+
     def send_rreq(self, neighbor, rreq):
-        neighbor.receive_rreq(self, rreq)
+        # Only queued: the flood is handled by flood_rreqs once the originator has sent a
+        # copy to every neighbour
+        self.rreq_queue.append((neighbor, rreq))
+
+    def flood_rreqs(self):
+        # Delivers the queued RREQs in order, so the flood travels breadth first (the
+        # destination first hears the RREQ over a shortest path) without recursion
+        while self.rreq_queue:
+            neighbor, rreq = self.rreq_queue.popleft()
+            neighbor.receive_rreq(self, rreq)
+            self.release(rreq)
 
     def send_rrep(self, neighbor, rrep):
         neighbor.receive_rrep(self, rrep)
@@ -98,6 +340,12 @@ class Network:
         neighbor.receive_route_reply(self, route_reply)
 
     def visualize(self, filename='graph_visualization.png'):
+        # matplotlib is only loaded when a picture is drawn
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        # Node positions are stored with the nodes, so no layout has to be computed
         pos = nx.get_node_attributes(self.graph, 'pos')
         energy_levels = [node.energy for node in self.nodes]
         plt.figure(figsize=(10, 8))
@@ -1,4 +1,7 @@
 import random
+from collections import deque
+from packet import RREQ, RREP, ANY_SINK
+from traces import describe_reading
 
 class Node:
     def __init__(self, node_id, position, role='sensor'):
@@ -6,48 +9,93 @@ class Node:
         self.position = position
         self.role = role
         self.energy = 100  # Assume all nodes start with 100 units of energy
-        self.data_queue = []
+        self.data_queue = deque()
+        self.routes = {}  # destination id -> next hop id
+        self.precursors = {}  # destination id -> ids of the nodes using this node as next hop
+        self.seq = 0  # Sequence number of the last packet created by this node
+        self.seen_rreqs = set()  # (source id, seq) of the RREQs already handled
 
-    def queue_data(self, data):
-        self.data_queue.append(data)
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def queue_data(self, packet):
+        self.data_queue.append(packet)
 
     def process_data_queue(self, network):
+        held = []  # Packets whose link has no capacity left, sent at a later step
         while self.data_queue:
-            data = self.data_queue.pop(0)
-            if data['destination'] == self:
-                print(f"Node {self.node_id} received data: {data['content']}")
+            packet = self.data_queue.popleft()
+            if packet.destination == self.node_id or (packet.destination == ANY_SINK and self.role == 'base_station'):
+                print(f"Node {self.node_id} received data: {describe_reading(packet.payload)}")
+                network.deliver(packet, self)
+            elif packet.ttl <= 0:
+                network.expire(packet)
             else:
-                recipient = self.find_next_hop_aodv(network, data['destination'])
-                if recipient:
+                recipient = self.find_next_hop_aodv(network, packet.destination)
+                if recipient is None:
+                    network.drop(packet)
+                elif network.reserve_link(self, recipient):
                     print(f"Node {self.node_id} forwarding data to Node {recipient.node_id}")
-                    self.send_data(recipient, data)
+                    self.send_data(network, recipient, packet)
+                else:
+                    held.append(packet)
+        self.data_queue.extend(held)
 
-    def find_next_hop_aodv(self, network, destination):
+    def find_next_hop_aodv(self, network, destination_id):
+        if destination_id == ANY_SINK:
+            # Towards the nearest base station, from the sink routing table
+            next_hop = network.sink_routing.next_hop.get(self.node_id) if network.sink_routing else None
+        else:
+            next_hop = self.routes.get(destination_id)
+            if next_hop is None and network.route_discovery:
+                if network.discover_route(self.node_id, destination_id):
+                    next_hop = self.routes.get(destination_id)
+        if next_hop is not None:
+            return network.node_mapping[next_hop]
         # Simplified routing: forward to a random neighbor (for demo purposes)
         neighbors = network.get_neighbors(self)
         if not neighbors:
             return None
         return random.choice(neighbors)
 
-    def send_data(self, recipient, data):
-        recipient.queue_data(data)
+    def send_data(self, network, recipient, packet):
+        packet.hop_count += 1
+        packet.ttl -= 1
+        network.send_data(recipient, packet)
 
     def send_rreq(self, network, destination):
         print(f"Node {self.node_id} broadcasting RREQ for Node {destination.node_id}")
-        rreq = {'source': self, 'destination': destination}
+        rreq = network.new_packet(RREQ, self, destination.node_id)
+        self.seen_rreqs.add((rreq.source, rreq.seq))
+        self.broadcast_rreq(network, rreq)
+        network.flood_rreqs()
+        network.release(rreq)
+
+    def broadcast_rreq(self, network, rreq):
+        # Each neighbour gets its own copy, one hop further than the RREQ received
         for neighbor in network.get_neighbors(self):
-            network.send_rreq(neighbor, rreq)
+            copy = network.copy_packet(rreq)
+            copy.hop_count = rreq.hop_count + 1
+            network.send_rreq(neighbor, copy)
 
     def receive_rreq(self, network, rreq):
-        if rreq['destination'] == self:
-            print(f"Node {self.node_id} received RREQ from Node {rreq['source'].node_id}")
-            rrep = {'source': self, 'destination': rreq['source']}
-            network.send_rrep(rreq['source'], rrep)
+        # Each RREQ is handled once per node, so the flood stops on cycles
+        key = (rreq.source, rreq.seq)
+        if key in self.seen_rreqs:
+            return
+        self.seen_rreqs.add(key)
+        if rreq.destination == self.node_id:
+            print(f"Node {self.node_id} received RREQ from Node {rreq.source}")
+            rrep = network.new_packet(RREP, self, rreq.source)
+            rrep.hop_count = rreq.hop_count
+            network.send_rrep(network.node_mapping[rreq.source], rrep)
         else:
-            self.send_rreq(network, rreq['destination'])
+            self.broadcast_rreq(network, rreq)
 
     def receive_rrep(self, network, rrep):
-        print(f"Node {self.node_id} received RREP from Node {rrep['source'].node_id}")
+        print(f"Node {self.node_id} received RREP from Node {rrep.source}")
+        network.deliver(rrep, self)
 
     def send_route_request(self, network, route_request):
         print(f"Node {self.node_id} broadcasting route request")
@@ -55,7 +103,7 @@ class Node:
             network.send_route_request(neighbor, route_request)
 
     def receive_route_request(self, network, route_request):
-        print(f"Node {self.node_id} received route request from Node {route_request['source'].node_id}")
+        print(f"Node {self.node_id} received route request from Node {route_request.source}")
 
     def receive_route_reply(self, network, route_reply):
-        print(f"Node {self.node_id} received route reply from Node {route_reply['source'].node_id}")
+        print(f"Node {self.node_id} received route reply from Node {route_reply.source}")
@@ -0,0 +1,85 @@
+import struct
+
+DATA = 0
+RREQ = 1
+RREP = 2
+
+KIND_NAMES = {DATA: 'DATA', RREQ: 'RREQ', RREP: 'RREP'}
+
+DEFAULT_TTL = 64  # Hops a packet may take before it is dropped; one byte on the wire, so at most 255
+ANY_SINK = 0xFFFFFFFF  # Destination of anycast data packets: delivered by whichever base station they reach
+
+
+class Packet:
+    __slots__ = ('kind', 'source', 'destination', 'seq', 'hop_count', 'ttl', 'created_at', 'payload')
+
+    def __init__(self, kind=DATA, source=0, destination=0, seq=0, created_at=0, payload=b'', ttl=DEFAULT_TTL):
+        self.kind = kind
+        self.source = source  # Node ids, not Node objects
+        self.destination = destination
+        self.seq = seq
+        self.hop_count = 0
+        self.ttl = ttl  # Hops left
+        self.created_at = created_at  # Simulation step (or emulation time) the packet was created at
+        self.payload = payload
+
+    def __repr__(self):
+        return (f"Packet({KIND_NAMES.get(self.kind, self.kind)}, {self.source} -> {self.destination}, "
+                f"seq={self.seq}, hops={self.hop_count}, ttl={self.ttl})")
+
+
+class PacketPool:
+    # Free list of delivered packets, reused for new ones instead of allocating
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.free = []
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, kind, source, destination, seq, created_at, payload=b'', ttl=DEFAULT_TTL):
+        if self.free:
+            packet = self.free.pop()
+            packet.kind = kind
+            packet.source = source
+            packet.destination = destination
+            packet.seq = seq
+            packet.hop_count = 0
+            packet.ttl = ttl
+            packet.created_at = created_at
+            packet.payload = payload
+            self.reused += 1
+            return packet
+        self.allocated += 1
+        return Packet(kind, source, destination, seq, created_at, payload, ttl)
+
+    def copy(self, packet):
+        duplicate = self.acquire(packet.kind, packet.source, packet.destination, packet.seq,
+                                 packet.created_at, packet.payload, packet.ttl)
+        duplicate.hop_count = packet.hop_count
+        return duplicate
+
+    def release(self, packet):
+        if len(self.free) < self.max_size:
+            packet.payload = b''
+            self.free.append(packet)
+
+
+# Wire format of a frame: link-layer next hop id, then the packet fields and the payload
+FRAME = struct.Struct('<IBIIIHBdH')
+
+
+def encode(packet, next_hop):
+    return FRAME.pack(next_hop, packet.kind, packet.source, packet.destination, packet.seq,
+                      packet.hop_count, packet.ttl, packet.created_at, len(packet.payload)) + packet.payload
+
+
+def decode(frame, pool=None):
+    # Returns (next hop id, packet)
+    next_hop, kind, source, destination, seq, hop_count, ttl, created_at, length = FRAME.unpack_from(frame)
+    payload = bytes(frame[FRAME.size:FRAME.size + length])
+    if pool is not None:
+        packet = pool.acquire(kind, source, destination, seq, created_at, payload, ttl)
+    else:
+        packet = Packet(kind, source, destination, seq, created_at, payload, ttl)
+    packet.hop_count = hop_count
+    return next_hop, packet
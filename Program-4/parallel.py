@@ -0,0 +1,389 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+import click
+import numpy as np
+
+# Partitioned execution of the data-gathering simulation, for networks too large to step
+# in one process. The topology is held as arrays (CSR adjacency, next hop towards the
+# nearest sink) and split between worker processes. Each worker owns the state of its
+# nodes (energy) in shared memory and moves the packets at its nodes one hop per step; a
+# packet that reaches a node of another worker is written to a shared buffer for that
+# worker and picked up after the step barrier. Every step is synchronous and the routes
+# are fixed, so the outcome does not depend on the number of workers.
+
+NO_ROUTE = -1
+STATS = ('sent', 'delivered', 'dropped', 'latency_sum', 'crossed', 'step_seconds')
+PACKET_FIELDS = 3  # Rows of the packet buffers: node the packet is at, source node, creation step
+
+
+class Topology:
+    def __init__(self, positions, indptr, indices, sinks, energy):
+        self.positions = positions  # (n, 2) float array
+        self.indptr = indptr  # CSR adjacency
+        self.indices = indices
+        self.sinks = sinks  # Dense indices of the base stations
+        self.energy = energy  # Initial energy of every node
+        self.distance, self.next_hop = nearest_sink_routes(indptr, indices, sinks)
+
+    @classmethod
+    def from_edges(cls, positions, edges, sinks, energy):
+        n = len(positions)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        heads = np.concatenate([edges[:, 0], edges[:, 1]])
+        tails = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.lexsort((tails, heads))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=n), out=indptr[1:])
+        return cls(positions, indptr, tails[order].astype(np.int32), np.asarray(sinks, dtype=np.int64), energy)
+
+    @classmethod
+    def from_network(cls, network):
+        ids = sorted(network.node_mapping)
+        index = {node_id: i for i, node_id in enumerate(ids)}
+        nodes = [network.node_mapping[node_id] for node_id in ids]
+        positions = np.array([node.position for node in nodes], dtype=float)
+        edges = [(index[a], index[b]) for a, b in network.graph.edges() if a != b]
+        sinks = [index[node.node_id] for node in network.get_base_stations()]
+        return cls.from_edges(positions, edges, sinks, np.array([node.energy for node in nodes], dtype=float))
+
+    @classmethod
+    def random_field(cls, nodes, sinks, neighbours=8.0, seed=None):
+        # Sensors at random in a square field, linked when closer than the radio range (chosen
+        # for about `neighbours` neighbours per node), and `sinks` base stations on a grid
+        rng = np.random.RandomState(seed)
+        side = 100.0 * np.sqrt(nodes / 1000.0)
+        radio_range = side * np.sqrt(neighbours / (np.pi * nodes))
+        columns = int(np.ceil(np.sqrt(sinks)))
+        rows = int(np.ceil(sinks / columns))
+        grid = [((k % columns + 0.5) * side / columns, (k // columns + 0.5) * side / rows) for k in range(sinks)]
+        positions = np.vstack([rng.uniform(0, side, size=(nodes, 2)), np.array(grid).reshape(-1, 2)])
+        edges = unit_disk_edges(positions, radio_range)
+        return cls.from_edges(positions, edges, np.arange(nodes, nodes + sinks), np.full(nodes + sinks, 100.0))
+
+    def subtree_sizes(self):
+        # Number of nodes routing through each node (itself included)
+        size = np.ones(len(self.next_hop), dtype=np.int64)
+        routed = self.distance > 0
+        for depth in range(int(self.distance.max(initial=0)), 0, -1):
+            level = np.flatnonzero(routed & (self.distance == depth))
+            np.add.at(size, self.next_hop[level], size[level])
+        return size
+
+
+def unit_disk_edges(positions, radio_range):
+    # Pairs of points closer than `radio_range`, found by bucketing the points in cells of
+    # the radio range and comparing each cell with itself and four of its neighbours
+    cells = np.floor(positions / radio_range).astype(np.int64)
+    width = cells[:, 1].max() + 2  # Row length of the cell keys, with a spare column for dy = -1
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    points = np.arange(len(positions))
+    found = []
+    for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        target = keys + dx * width + dy
+        low = np.searchsorted(sorted_keys, target, 'left')
+        counts = np.searchsorted(sorted_keys, target, 'right') - low
+        first = np.repeat(points, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(low, counts) + offsets]
+        close = ((positions[first] - positions[second]) ** 2).sum(axis=1) <= radio_range ** 2
+        if dx == 0 and dy == 0:
+            close &= first < second
+        found.append(np.column_stack([first[close], second[close]]))
+    return np.concatenate(found)
+
+
+def nearest_sink_routes(indptr, indices, sinks):
+    # Multi-source BFS from all sinks at once: hop distance to the nearest sink and the next
+    # hop towards it (NO_ROUTE for sinks and for nodes that cannot reach any sink)
+    n = len(indptr) - 1
+    distance = np.full(n, -1, dtype=np.int64)
+    next_hop = np.full(n, NO_ROUTE, dtype=np.int32)
+    frontier = np.unique(sinks)
+    distance[frontier] = 0
+    depth = 0
+    degree = np.diff(indptr)
+    while frontier.size:
+        counts = degree[frontier]
+        parents = np.repeat(frontier, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        neighbours = indices[np.repeat(indptr[frontier], counts) + offsets]
+        new = distance[neighbours] < 0
+        frontier, first = np.unique(neighbours[new], return_index=True)
+        depth += 1
+        distance[frontier] = depth
+        next_hop[frontier] = parents[new][first]
+    return distance, next_hop
+
+
+def partition_spatial(topology, workers):
+    # Vertical strips holding the same number of nodes
+    owner = np.empty(len(topology.positions), dtype=np.int32)
+    owner[np.argsort(topology.positions[:, 0], kind='stable')] = np.arange(len(owner)) * workers // len(owner)
+    return owner
+
+
+def partition_catchments(topology, workers):
+    # Graph cut along the catchment areas of the sinks (the nodes nearest to each one), so
+    # packets never change worker; catchments are shared out largest first. Unreachable
+    # nodes fall back to the spatial strips, they drop their packets anyway.
+    owner = partition_spatial(topology, workers)
+    sink_of = np.arange(len(owner))
+    routed = topology.distance > 0
+    for depth in range(1, int(topology.distance.max(initial=0)) + 1):
+        level = np.flatnonzero(routed & (topology.distance == depth))
+        sink_of[level] = sink_of[topology.next_hop[level]]
+    reachable = topology.distance >= 0
+    sizes = np.bincount(sink_of[reachable], minlength=len(owner))
+    load = np.zeros(workers, dtype=np.int64)
+    sink_owner = {}
+    for sink in sorted(topology.sinks.tolist(), key=lambda s: -sizes[s]):
+        worker = int(np.argmin(load))
+        sink_owner[sink] = worker
+        load[worker] += sizes[sink]
+    lookup = np.zeros(len(owner), dtype=np.int32)
+    for sink, worker in sink_owner.items():
+        lookup[sink] = worker
+    owner[reachable] = lookup[sink_of[reachable]]
+    return owner
+
+
+def buffer_layout(topology, owner, workers):
+    # Row range of the shared buffer from worker a to worker b. A packet moves one hop per
+    # step along fixed routes, so at most subtree_size(u) packets are at node u at once, and
+    # the packets crossing from a to b in one step are at most the subtree sizes of the
+    # nodes of a whose next hop belongs to b.
+    size = topology.subtree_sizes()
+    routed = np.flatnonzero(topology.next_hop >= 0)
+    source = owner[routed]
+    target = owner[topology.next_hop[routed]]
+    capacity = np.zeros((workers, workers), dtype=np.int64)
+    np.add.at(capacity, (source, target), size[routed])
+    np.fill_diagonal(capacity, 0)
+    offsets = np.zeros(workers * workers + 1, dtype=np.int64)
+    np.cumsum(capacity.ravel(), out=offsets[1:])
+    return offsets
+
+
+class SharedArrays:
+    # Numpy arrays in named shared memory blocks, created by the parent and attached by the workers
+    def __init__(self):
+        self.blocks = {}
+        self.specs = {}
+
+    def create(self, name, shape, dtype, value=None):
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.blocks[name] = block
+        self.specs[name] = (block.name, shape, dtype.str)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if value is not None:
+            array[...] = value
+        return array
+
+    def release(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+def attach(specs):
+    blocks = {}
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        blocks[name] = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+    return blocks, arrays
+
+
+def run_worker(worker, workers, specs, steps, tx_cost, barrier=None):
+    blocks, shared = attach(specs)
+    try:
+        step_worker(worker, workers, shared, steps, tx_cost, barrier)
+    except BaseException:
+        # Release the other workers from the step barrier, they fail with BrokenBarrierError
+        if barrier is not None:
+            barrier.abort()
+        raise
+    finally:
+        shared.clear()
+        for block in blocks.values():
+            block.close()
+
+
+def step_worker(worker, workers, shared, steps, tx_cost, barrier):
+    energy = shared['energy']
+    next_hop = shared['next_hop']
+    is_sink = shared['is_sink']
+    owner = shared['owner']
+    buffers = shared['buffers']
+    counts = shared['counts']
+    offsets = shared['offsets']
+    stats = shared['stats'][worker]
+
+    sensors = np.flatnonzero((owner == worker) & ~is_sink)
+    at = np.empty(0, dtype=np.int32)  # Packets held by this worker
+    source = np.empty(0, dtype=np.int32)
+    created = np.empty(0, dtype=np.int32)
+    if barrier is not None:
+        barrier.wait()
+    started = time.perf_counter()
+    for step in range(steps):
+        # Every live sensor produces one reading
+        senders = sensors[energy[sensors] > 0]
+        at = np.concatenate([at, senders.astype(np.int32)])
+        source = np.concatenate([source, senders.astype(np.int32)])
+        created = np.concatenate([created, np.full(len(senders), step, dtype=np.int32)])
+        stats[0] += len(senders)
+
+        # One hop: nodes without energy or route drop what they hold, the others transmit
+        ok = (energy[at] > 0) & (next_hop[at] != NO_ROUTE)
+        stats[2] += len(ok) - int(ok.sum())
+        at, source, created = at[ok], source[ok], created[ok]
+        transmitters, transmissions = np.unique(at, return_counts=True)
+        energy[transmitters] -= tx_cost * transmissions
+        at = next_hop[at]
+
+        arrived = is_sink[at]
+        stats[1] += int(arrived.sum())
+        stats[3] += int((step + 1 - created[arrived]).sum())
+        at, source, created = at[~arrived], source[~arrived], created[~arrived]
+
+        if workers > 1:
+            # Hand the packets now at another worker's nodes over through the shared buffers
+            destination = owner[at]
+            leaving = destination != worker
+            for other in range(workers):
+                if other == worker:
+                    continue
+                moving = np.flatnonzero(destination == other)
+                start, end = offsets[worker * workers + other], offsets[worker * workers + other + 1]
+                if len(moving) > end - start:
+                    raise RuntimeError(f"Boundary buffer {worker} -> {other} is too small")
+                rows = buffers[start:start + len(moving)]
+                rows[:, 0] = at[moving]
+                rows[:, 1] = source[moving]
+                rows[:, 2] = created[moving]
+                counts[worker, other] = len(moving)
+            stats[4] += int(leaving.sum())
+            at, source, created = at[~leaving], source[~leaving], created[~leaving]
+            barrier.wait()
+            incoming = [buffers[offsets[other * workers + worker]:offsets[other * workers + worker] + counts[other, worker]]
+                        for other in range(workers) if other != worker]
+            incoming = np.concatenate(incoming) if incoming else np.empty((0, PACKET_FIELDS), dtype=np.int32)
+            at = np.concatenate([at, incoming[:, 0]])
+            source = np.concatenate([source, incoming[:, 1]])
+            created = np.concatenate([created, incoming[:, 2]])
+            barrier.wait()  # The buffers can be written again
+    stats[5] = time.perf_counter() - started
+
+
+def run_partitioned(topology, steps, workers=1, partition='spatial', tx_cost=0.01):
+    # Runs `steps` steps with `workers` processes (in this process for one worker) and
+    # returns the totals, the final energy of the nodes and the timings
+    setup_start = time.perf_counter()
+    owner = partition_catchments(topology, workers) if partition == 'catchment' else partition_spatial(topology, workers)
+    offsets = buffer_layout(topology, owner, workers)
+    n = len(topology.next_hop)
+    arrays = SharedArrays()
+    try:
+        arrays.create('energy', (n,), np.float64, topology.energy)
+        arrays.create('next_hop', (n,), np.int32, topology.next_hop)
+        is_sink = np.zeros(n, dtype=bool)
+        is_sink[topology.sinks] = True
+        arrays.create('is_sink', (n,), np.bool_, is_sink)
+        arrays.create('owner', (n,), np.int32, owner)
+        arrays.create('offsets', offsets.shape, np.int64, offsets)
+        arrays.create('buffers', (int(offsets[-1]), PACKET_FIELDS), np.int32)
+        arrays.create('counts', (workers, workers), np.int64, 0)
+        stats = arrays.create('stats', (workers, len(STATS)), np.float64, 0)
+        setup_seconds = time.perf_counter() - setup_start
+
+        wall_start = time.perf_counter()
+        if workers == 1:
+            run_worker(0, 1, arrays.specs, steps, tx_cost)
+        else:
+            barrier = multiprocessing.Barrier(workers)
+            processes = [multiprocessing.Process(target=run_worker,
+                                                 args=(worker, workers, arrays.specs, steps, tx_cost, barrier))
+                         for worker in range(workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                while process.is_alive():
+                    process.join(0.5)
+                    # A worker killed without running its exception handler (out of memory,
+                    # signal) cannot abort the barrier itself
+                    if any(other.exitcode not in (None, 0) for other in processes):
+                        barrier.abort()
+            if any(process.exitcode != 0 for process in processes):
+                raise RuntimeError("A simulation worker failed")
+        wall_seconds = time.perf_counter() - wall_start
+
+        totals = dict(zip(STATS, stats.sum(axis=0).tolist()))
+        energy = np.ndarray((n,), dtype=np.float64, buffer=arrays.blocks['energy'].buf).copy()
+        step_seconds = float(stats[:, STATS.index('step_seconds')].max())
+    finally:
+        arrays.release()
+    delivered = int(totals['delivered'])
+    return {
+        'nodes': n,
+        'sinks': len(topology.sinks),
+        'workers': workers,
+        'partition': partition,
+        'steps': steps,
+        'sent': int(totals['sent']),
+        'delivered': delivered,
+        'dropped': int(totals['dropped']),
+        'delivery_ratio': delivered / totals['sent'] if totals['sent'] else None,
+        'average_latency': totals['latency_sum'] / delivered if delivered else None,
+        'dead_nodes': int((energy <= 0).sum()),
+        'packets_crossed': int(totals['crossed']),
+        'boundary_buffer_rows': int(offsets[-1]),
+        'setup_seconds': setup_seconds,
+        'step_seconds': step_seconds,
+        'wall_seconds': wall_seconds,
+    }, energy
+
+
+def benchmark(topology, steps, worker_counts, partition='spatial', tx_cost=0.01):
+    # Runs the same simulation with each worker count; speedups are relative to the first
+    # count and every run is checked against the first one
+    reports = []
+    reference = None
+    for workers in worker_counts:
+        report, energy = run_partitioned(topology, steps, workers, partition, tx_cost)
+        outcome = (report['sent'], report['delivered'], report['dropped'], report['average_latency'])
+        if reference is None:
+            reference = (outcome, energy, report['step_seconds'])
+        report['matches_reference'] = outcome == reference[0] and np.array_equal(energy, reference[1])
+        report['speedup'] = reference[2] / report['step_seconds'] if report['step_seconds'] else None
+        reports.append(report)
+    return reports
+
+
+@click.command()
+@click.option('--nodes', type=int, default=100000, help='Number of sensors in the field')
+@click.option('--sinks', type=click.IntRange(min=1), default=16, help='Number of base stations, on a grid over the field')
+@click.option('--steps', type=int, default=50, help='Number of simulation steps')
+@click.option('--workers', type=str, default='1,2,4', help='Comma separated worker counts to compare')
+@click.option('--partition', type=click.Choice(['spatial', 'catchment']), default='spatial', help='How nodes are split between workers')
+@click.option('--tx-cost', type=float, default=0.01, help='Energy spent per packet transmission')
+@click.option('--seed', type=int, default=1, help='Random seed of the node placement')
+def run_benchmark(nodes, sinks, steps, workers, partition, tx_cost, seed):
+    worker_counts = [int(count) for count in workers.split(',')]
+    if min(worker_counts) < 1:
+        raise click.BadParameter('worker counts must be at least 1', param_hint='--workers')
+    build_start = time.perf_counter()
+    topology = Topology.random_field(nodes, sinks, seed=seed)
+    print(f"Topology: {nodes + sinks} nodes, {len(topology.indices) // 2} links, "
+          f"built in {time.perf_counter() - build_start:.2f}s")
+    for report in benchmark(topology, steps, worker_counts, partition, tx_cost):
+        print(report)
+
+
+if __name__ == '__main__':
+    run_benchmark()
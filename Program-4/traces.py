@@ -0,0 +1,94 @@
+import mmap
+import struct
+
+# A reading is a fixed-size binary record: timestamp (seconds), node id, value
+READING = struct.Struct('<dIf')
+
+
+def pack_reading(timestamp, node_id, value):
+    return READING.pack(timestamp, node_id, value)
+
+
+def unpack_reading(payload):
+    return READING.unpack(payload)
+
+
+def describe_reading(payload):
+    timestamp, node_id, value = READING.unpack(payload)
+    return f"Temperature: {value:.2f}C"
+
+
+def iter_binary_trace(path):
+    # Yields (timestamp, node_id, value) from a file of packed READING records
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            unpack_from = READING.unpack_from
+            for offset in range(0, len(mm) - READING.size + 1, READING.size):
+                yield unpack_from(mm, offset)
+
+
+def iter_csv_trace(path, time_column='timestamp', node_column='node_id', value_column='value'):
+    # Yields (timestamp, node_id, value) from a CSV file with a header line.
+    # Timestamps are numbers of seconds; rows that cannot be parsed are skipped.
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = [name.strip().decode() for name in mm.readline().split(b',')]
+            time_index = header.index(time_column)
+            node_index = header.index(node_column)
+            value_index = header.index(value_column)
+            for line in iter(mm.readline, b''):
+                fields = line.split(b',')
+                try:
+                    yield (float(fields[time_index]), int(fields[node_index]), float(fields[value_index]))
+                except (IndexError, ValueError):
+                    continue
+
+
+def iter_trace(path, **csv_columns):
+    if path.endswith('.csv'):
+        return iter_csv_trace(path, **csv_columns)
+    return iter_binary_trace(path)
+
+
+def convert_csv_to_binary(csv_path, binary_path, **csv_columns):
+    # Binary traces replay faster: no text parsing, one struct unpack per record
+    with open(binary_path, 'wb') as out:
+        for reading in iter_csv_trace(csv_path, **csv_columns):
+            out.write(READING.pack(*reading))
+
+
+class TraceSource:
+    # Replays a trace as packet payloads: every simulation step covers `step_seconds`
+    # of the trace, starting at its first timestamp. Readings are mapped onto nodes by id;
+    # only sensors with energy left send them.
+    def __init__(self, path, step_seconds=1.0, **csv_columns):
+        self.readings = iter_trace(path, **csv_columns)
+        self.step_seconds = step_seconds
+        self.start = None
+        self.pending = next(self.readings, None)
+        self.replayed = 0
+        self.skipped = 0  # Readings of unknown node ids, base stations or nodes without energy
+
+    def exhausted(self):
+        return self.pending is None
+
+    def payloads_for_step(self, step, node_mapping):
+        # Yields (node, payload) for the readings of simulation step `step`
+        if self.pending is None:
+            return
+        if self.start is None:
+            self.start = self.pending[0]
+        end = self.start + (step + 1) * self.step_seconds
+        while self.pending is not None and self.pending[0] < end:
+            timestamp, node_id, value = self.pending
+            node = node_mapping.get(node_id)
+            if node is None or node.role != 'sensor' or node.energy <= 0:
+                self.skipped += 1
+            else:
+                self.replayed += 1
+                yield node, READING.pack(timestamp, node_id, value)
+            self.pending = next(self.readings, None)
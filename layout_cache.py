@@ -0,0 +1,117 @@
+"""
+Node positions for drawing the network graphs
+
+Positions come from the stored node coordinates (node attribute 'pos') when
+every node has them. Otherwise a layout is computed once and cached in memory
+and on disk, keyed by a hash of the topology, so restarting a program with the
+same topology does not compute the layout again.
+
+Every session of the Dash programs draws its own random topology, so both
+caches are bounded like the session store: at most WSN_MAX_SESSIONS layouts
+(256 by default) are kept, and the least recently used ones are dropped from
+memory and deleted from disk.
+
+Small graphs use the spring layout. Its cost grows with the square of the
+number of nodes per iteration, so large graphs use the spectral layout instead,
+which works on the sparse adjacency matrix.
+
+The cache directory is .layout_cache next to this file, or WSN_LAYOUT_CACHE.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import networkx as nx
+
+from session_store import DEFAULT_MAX_SESSIONS
+
+SPRING_LAYOUT_MAX_NODES = 500  # Larger graphs use the spectral layout
+LAYOUT_SEED = 42
+MAX_LAYOUTS = int(os.environ.get('WSN_MAX_SESSIONS', DEFAULT_MAX_SESSIONS))
+CACHE_DIR = os.environ.get('WSN_LAYOUT_CACHE',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.layout_cache'))
+
+# Layouts recently loaded or computed by this process, least recently used first
+layouts = OrderedDict()
+
+
+def topology_hash(G):
+    nodes = sorted(map(repr, G.nodes()))
+    edges = sorted(repr(tuple(sorted(edge, key=repr))) for edge in G.edges())
+    digest = hashlib.sha1()
+    digest.update('\n'.join(nodes).encode())
+    digest.update(b'\0')
+    digest.update('\n'.join(edges).encode())
+    return digest.hexdigest()
+
+
+def compute_layout(G):
+    if G.number_of_nodes() <= SPRING_LAYOUT_MAX_NODES:
+        return nx.spring_layout(G, seed=LAYOUT_SEED)
+    try:
+        return nx.spectral_layout(G)
+    except ImportError:
+        # The sparse eigensolver needs scipy
+        return nx.circular_layout(G)
+
+
+def load_layout(path):
+    with open(path) as f:
+        return {node: (x, y) for node, x, y in json.load(f)}
+
+
+def save_layout(path, pos):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump([[node, float(x), float(y)] for node, (x, y) in pos.items()], f)
+    os.replace(tmp_path, path)
+
+
+def prune_cache_dir(max_files=MAX_LAYOUTS):
+    # Delete the least recently used layout files (by modification time, refreshed on load)
+    try:
+        entries = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith('.json')]
+    except OSError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass  # Already removed by another process
+
+
+def get_layout(G):
+    stored = nx.get_node_attributes(G, 'pos')
+    if stored and len(stored) == G.number_of_nodes():
+        return stored
+
+    key = topology_hash(G)
+    if key in layouts:
+        layouts.move_to_end(key)
+        return layouts[key]
+
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    pos = None
+    if os.path.exists(path):
+        try:
+            pos = load_layout(path)
+            os.utime(path)  # Keeps recently used files when the directory is pruned
+        except (OSError, ValueError):
+            pos = None
+    if pos is None or set(pos) != set(G.nodes()):
+        pos = compute_layout(G)
+        try:
+            save_layout(path, pos)
+        except OSError:
+            pass  # The cache is an optimisation only
+        prune_cache_dir()
+    layouts[key] = pos
+    while len(layouts) > MAX_LAYOUTS:
+        layouts.popitem(last=False)
+    return pos
@@ -0,0 +1,213 @@
+"""
+Headless batch runs of the MAC-layer simulations
+
+Runs the CSMA/CD (program1), 3-step handshake (program2) or TDMA/FDMA (program3)
+simulation without a browser, on a simulated clock and as fast as possible.
+Several senders run concurrently on the same topology; for CSMA/CD they share
+the medium, so they can collide and back off.
+
+The run stops after `--transfers` successful transfers or `--duration` simulated
+seconds, whichever comes first, and writes its metrics as JSON.
+
+With `--phy`, the nodes are placed at random in a square field, linked when they can hear
+each other, and every update is checked against the SINR physical layer of phy.py:
+CSMA/CD senders sense the carrier and collide when their receiver cannot decode them,
+FDMA senders on the same band interfere.
+
+Example:
+    python mac_cli.py csma --nodes 2000 --edge-prob 0.01 --senders 20 --transfers 1000 --seed 1 --output csma.json
+    python mac_cli.py csma --nodes 2000 --phy --senders 200 --duration 3600 --seed 1
+"""
+
+import argparse
+import importlib
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import networkx as nx
+
+PROTOCOLS = {
+    'csma': 'program1',
+    'handshake': 'program2',
+    'tdma-fdma': 'program3',
+}
+
+# Simulated seconds per update. Backoff times are whole seconds, so a coarser tick
+# would make colliding senders always retry in the same update.
+DEFAULT_TICK = 1.0
+
+SIMULATION_EPOCH = datetime(2000, 1, 1)
+
+
+def silent(message):
+    pass
+
+
+def build_phy_graph(nodes, field):
+    from phy import SinrChannel
+
+    positions = {node: (random.uniform(0, field), random.uniform(0, field)) for node in range(nodes)}
+    channel = SinrChannel(positions)
+    G = nx.Graph()
+    G.add_nodes_from(positions)
+    G.add_edges_from(channel.links())
+    return G, channel
+
+
+def positive(number_type):
+    # argparse type: a number of `number_type` greater than zero
+    def parse(text):
+        value = number_type(text)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(f"must be greater than 0, got {text}")
+        return value
+    return parse
+
+
+def metric_totals(states):
+    totals = {}
+    for state in states:
+        for key, value in state['metrics'].items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def run_headless(protocol, nodes, senders=1, transfers=None, duration=None, seed=None,
+                 edge_prob=0.5, tick=None, log=silent, phy=False, field=None, on_tick=None):
+    # on_tick(tick index, simulated seconds, sender states) is called after every update
+    if transfers is None and duration is None:
+        raise ValueError("Give a number of transfers or a simulated duration")
+    if senders < 1:
+        raise ValueError("At least one sender is needed")
+    if transfers is not None and transfers <= 0:
+        raise ValueError("The number of transfers must be greater than 0")
+    if duration is not None and duration <= 0:
+        raise ValueError("The simulated duration must be greater than 0")
+    if tick is not None and tick <= 0:
+        raise ValueError("The tick must be greater than 0")
+    program = importlib.import_module(PROTOCOLS[protocol])
+    tick = tick or DEFAULT_TICK
+
+    random.seed(seed)
+    wall_start = time.perf_counter()
+    channel = None
+    if phy:
+        # About 8 neighbours per node with the default radio parameters
+        field = field or 16.0 * nodes ** 0.5
+        G, channel = build_phy_graph(nodes, field)
+    else:
+        G = program.build_graph(nodes, edge_prob)
+    build_seconds = time.perf_counter() - wall_start
+    if G.number_of_edges() == 0:
+        raise ValueError("The topology has no links, no transfer can succeed")
+
+    states = [program.new_simulation_state() for _ in range(senders)]
+    advance_kwargs = {'max_steps': None, 'log': log}
+    if protocol == 'csma':
+        advance_kwargs['path_busy'] = {}  # The medium shared by all senders
+
+    elapsed = 0.0
+    ticks = 0
+    completed = 0
+    while True:
+        current_time = SIMULATION_EPOCH + timedelta(seconds=elapsed)
+        if channel is not None and protocol == 'csma':
+            advance_kwargs['channel'] = channel
+            advance_kwargs['on_air'] = [state['paths'][0][0] for state in states if state['stage'] == 'data_transfer']
+        for state in states:
+            program.advance_simulation(G, state, current_time, **advance_kwargs)
+        if channel is not None and protocol == 'csma':
+            program.resolve_collisions(channel, states, current_time, advance_kwargs['path_busy'], log)
+        elif channel is not None and protocol == 'tdma-fdma':
+            program.resolve_slot(channel, states, log)
+        ticks += 1
+        completed = sum(state['metrics']['transfers'] for state in states)
+        elapsed += tick
+        if on_tick:
+            on_tick(ticks, elapsed, states)
+        if transfers is not None and completed >= transfers:
+            break
+        if duration is not None and elapsed >= duration:
+            break
+    wall_seconds = time.perf_counter() - wall_start
+
+    totals = metric_totals(states)
+    handshakes = totals.pop('handshakes')
+    handshake_latency = totals.pop('handshake_latency')
+    return {
+        'protocol': protocol,
+        'nodes': nodes,
+        'edges': G.number_of_edges(),
+        'senders': senders,
+        'seed': seed,
+        'phy': phy,
+        'field': field,
+        'tick_seconds': tick,
+        'ticks': ticks,
+        'simulated_seconds': elapsed,
+        'transfers_per_second': completed / elapsed if elapsed else 0.0,
+        'average_handshake_latency': handshake_latency / handshakes if handshakes else None,
+        **totals,
+        'wall_seconds': wall_seconds,
+        'graph_build_seconds': build_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a MAC-layer simulation headless and write JSON metrics')
+    parser.add_argument('protocol', choices=sorted(PROTOCOLS))
+    parser.add_argument('--nodes', type=int, default=8, help='Number of nodes in the network')
+    parser.add_argument('--edge-prob', type=float, default=0.5, help='Probability of a link between two nodes')
+    parser.add_argument('--senders', type=positive(int), default=1, help='Number of concurrent senders')
+    parser.add_argument('--transfers', type=positive(int), help='Stop after this many successful transfers')
+    parser.add_argument('--duration', type=positive(float), help='Stop after this many simulated seconds')
+    parser.add_argument('--seed', type=int, help='Random seed')
+    parser.add_argument('--tick', type=positive(float), help='Simulated seconds per update (default: 1)')
+    parser.add_argument('--phy', action='store_true', help='Place the nodes in a field and use the SINR physical layer')
+    parser.add_argument('--field', type=positive(float), help='Side of the square field in metres (with --phy)')
+    parser.add_argument('--output', help='Write the metrics to this JSON file instead of stdout')
+    parser.add_argument('--results', help='Also record the run and its per-update metrics in this SQLite database')
+    parser.add_argument('--verbose', action='store_true', help='Print the protocol messages')
+    args = parser.parse_args(argv)
+
+    if args.transfers is None and args.duration is None:
+        args.transfers = 100
+
+    store = on_tick = None
+    if args.results:
+        from results_store import ResultsStore
+
+        store = ResultsStore(args.results)
+        parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'results', 'verbose')}
+        run_id = store.start_run('mac_cli', parameters, args.protocol, args.nodes, args.seed)
+
+        def on_tick(ticks, elapsed, states):
+            store.add_metrics(run_id, ticks, {'simulated_seconds': elapsed, **metric_totals(states)})
+
+    try:
+        metrics = run_headless(args.protocol, args.nodes, args.senders, args.transfers, args.duration,
+                               args.seed, args.edge_prob, args.tick, print if args.verbose else silent,
+                               args.phy, args.field, on_tick)
+        if store:
+            store.finish_run(run_id, metrics)
+    except (Exception, KeyboardInterrupt) as error:
+        # The run keeps the metrics recorded so far, with the error as its summary
+        if store:
+            store.finish_run(run_id, {'error': repr(error)})
+        raise
+    finally:
+        if store:
+            store.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+    else:
+        json.dump(metrics, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
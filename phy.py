@@ -0,0 +1,83 @@
+"""
+SINR physical layer for the MAC simulations
+
+The path loss between every pair of nodes is computed once from the node
+positions (log-distance model) and kept as a matrix of linear gains. A slot
+with many concurrent transmitters is then evaluated with one batched NumPy
+operation: for each receiver the signal of its transmitter is compared with the
+noise plus the power of every other transmitter on the same channel, and the
+packet is received when that SINR reaches the threshold.
+
+Used by program1 (CSMA/CD collisions and carrier sensing), program3 (TDMA and
+FDMA slots), program5 (LEACH member-to-head transmissions) and mac_cli.py.
+"""
+
+import numpy as np
+
+
+def dbm_to_mw(dbm):
+    return 10.0 ** (np.asarray(dbm, dtype=float) / 10.0)
+
+
+class SinrChannel:
+    def __init__(self, positions, tx_power_dbm=0.0, path_loss_exponent=3.0, reference_loss_db=40.0,
+                 noise_dbm=-95.0, sinr_threshold_db=10.0, carrier_sense_dbm=-85.0, reference_distance=1.0):
+        # positions: node -> (x, y) in metres
+        self.nodes = list(positions)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        coords = np.array([positions[node] for node in self.nodes], dtype=float).reshape(-1, 2)
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b keeps the temporaries at n x n
+        squared = (coords ** 2).sum(axis=1)
+        distance_sq = squared[:, None] + squared[None, :] - 2.0 * (coords @ coords.T)
+        distance = np.sqrt(np.maximum(distance_sq, reference_distance ** 2))
+        path_loss_db = reference_loss_db + 10.0 * path_loss_exponent * np.log10(distance / reference_distance)
+        # gain[i, j]: power in mW received at node j when node i transmits
+        self.gain = dbm_to_mw(tx_power_dbm - path_loss_db)
+        np.fill_diagonal(self.gain, 0.0)
+        self.noise = float(dbm_to_mw(noise_dbm))
+        self.threshold = float(10.0 ** (sinr_threshold_db / 10.0))
+        self.carrier_sense = float(dbm_to_mw(carrier_sense_dbm))
+
+    def indices(self, nodes):
+        return np.fromiter((self.index[node] for node in nodes), dtype=np.intp, count=len(nodes))
+
+    def sinr(self, transmitters, receivers, channels=None):
+        # SINR (linear) of the i-th receiver for the i-th transmitter, when all of
+        # `transmitters` send at once. Transmitters only interfere on the same channel.
+        if len(transmitters) == 0:
+            return np.zeros(0)
+        tx = self.indices(transmitters)
+        rx = self.indices(receivers)
+        received = self.gain[np.ix_(tx, rx)]  # received[k, i]: power of transmitter k at receiver i
+        if channels is not None:
+            channels = np.asarray(channels)
+            received = received * (channels[:, None] == channels[None, :])
+        signal = received[np.arange(len(tx)), np.arange(len(rx))]
+        interference = received.sum(axis=0) - signal
+        return signal / (self.noise + interference)
+
+    def receive(self, transmitters, receivers, channels=None):
+        # Boolean array: which receptions succeed. A receiver that is transmitting itself
+        # (half duplex) on the channel it listens to receives nothing.
+        ok = self.sinr(transmitters, receivers, channels) >= self.threshold
+        if len(transmitters):
+            transmitting = self.indices(transmitters)[:, None] == self.indices(receivers)[None, :]
+            if channels is not None:
+                channels = np.asarray(channels)
+                transmitting &= channels[:, None] == channels[None, :]
+            ok &= ~transmitting.any(axis=0)
+        return ok
+
+    def channel_busy(self, transmitters, listener):
+        # Carrier sensing: total power of the transmitters heard at `listener`
+        if len(transmitters) == 0:
+            return False
+        sensed = self.gain[self.indices(transmitters), self.index[listener]].sum()
+        return bool(sensed >= self.carrier_sense)
+
+    def links(self, margin_db=3.0):
+        # Pairs of nodes that can hear each other without interference, with `margin_db`
+        # to spare, so that a link does not break as soon as anyone else transmits
+        snr_needed = self.threshold * 10.0 ** (margin_db / 10.0)
+        i, j = np.nonzero(np.triu(self.gain / self.noise >= snr_needed, k=1))
+        return [(self.nodes[a], self.nodes[b]) for a, b in zip(i.tolist(), j.tolist())]
@@ -1,46 +1,69 @@
 import networkx as nx
-import plotly.graph_objects as go
-import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
 import random
 from datetime import datetime
-import threading
 from collections import deque
+from session_store import get_store, new_session_id
+from layout_cache import get_layout
 
-# Create a graph for the wireless sensor network
-G = nx.Graph()
 num_nodes = 8
-nodes = range(num_nodes)
-G.add_nodes_from(nodes)
-edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() > 0.5]
-G.add_edges_from(edges)
-pos = nx.spring_layout(G)
-
-# Initialize Dash app
-app = dash.Dash(__name__)
-
-# State to track the transmission
-transmission_state = {
-    'step': 0,
-    'paths': [],
-    'start_time': None,
-    'stage': 'idle',
-    'medium_free': True,
-    'waiting_nodes': deque(),
-    'collision': False,
-    'backoff_time': 0,
-    'active_path': None
-}
-
-# Dictionary to track the busy state of each path
-path_busy = {}
-
-# Lock for simulating medium access control
-transmission_lock = threading.Lock()
+
+# Create a graph for the wireless sensor network
+def build_graph(num_nodes, edge_prob=0.5):
+    G = nx.Graph()
+    nodes = range(num_nodes)
+    G.add_nodes_from(nodes)
+    edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() < edge_prob]
+    G.add_edges_from(edges)
+    return G
+
+# State to track the transmission of one sender
+def new_simulation_state():
+    return {
+        'step': 0,
+        'paths': [],
+        'start_time': None,  # Start of the transfer, then of the granted request; acknowledgment and data transfer are timed from it
+        'request_time': None,  # First attempt of the current transfer
+        'backoff_start': None,  # Start of the current backoff
+        'stage': 'idle',
+        'medium_free': True,
+        'waiting_nodes': deque(),
+        'collision': False,
+        'backoff_time': 0,
+        'active_path': None,
+        # Busy state of each path, keyed by path tuple
+        'path_busy': {},
+        'metrics': {
+            'transfers': 0,
+            'collisions': 0,
+            'backoffs': 0,
+            'handshakes': 0,
+            'handshake_latency': 0.0  # Total seconds from request to acknowledgment
+        }
+    }
+
+# State of one session (one browser tab): its own topology and sender
+def new_transmission_state():
+    G = build_graph(num_nodes)
+    transmission_state = new_simulation_state()
+    transmission_state['nodes'] = list(G.nodes())
+    transmission_state['edges'] = list(G.edges())
+    return transmission_state
+
+def session_graph(transmission_state):
+    G = nx.Graph()
+    G.add_nodes_from(transmission_state['nodes'])
+    G.add_edges_from(transmission_state['edges'])
+    return G
 
 # Function to generate Plotly figure
-def create_figure(paths, step, current_time, waiting_nodes, collision):
+def create_figure(G, transmission_state, current_time):
+    import plotly.graph_objects as go
+
+    pos = get_layout(G)
+    paths = transmission_state['paths']
+    step = transmission_state['step']
+    waiting_nodes = transmission_state['waiting_nodes']
+    collision = transmission_state['collision']
     edge_trace = []
     for edge in G.edges():
         x0, y0 = pos[edge[0]]
@@ -113,36 +136,53 @@ def create_figure(paths, step, current_time, waiting_nodes, collision):
 
     return fig
 
-# App layout
-app.layout = html.Div([
-    dcc.Graph(id='network-graph'),
-    dcc.Interval(
-        id='interval-component',
-        interval=1*10000,  # Update every second
-        n_intervals=0
-    )
-])
-
-@app.callback(
-    Output('network-graph', 'figure'),
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n):
-    global transmission_state
-    step = transmission_state['step']
+# App layout, rebuilt on every page load so each tab gets its own session ID
+def serve_layout():
+    from dash import dcc, html
+
+    return html.Div([
+        dcc.Store(id='session-id', data=new_session_id()),
+        dcc.Graph(id='network-graph'),
+        dcc.Interval(
+            id='interval-component',
+            interval=1*10000,  # Update every second
+            n_intervals=0
+        )
+    ])
+
+def update_graph(n, session_id):
+    # The session transaction serializes the steps of one session across workers
+    with get_store().transaction(session_id, new_transmission_state) as transmission_state:
+        G = session_graph(transmission_state)
+        return simulate_step(G, transmission_state)
+
+def simulate_step(G, transmission_state):
     current_time = datetime.now()
+    advance_simulation(G, transmission_state, current_time)
+    return create_figure(G, transmission_state, current_time)
+
+# Advance the CSMA/CD state machine of one sender to `current_time`.
+# The headless runner (mac_cli.py) passes a simulated clock, a `path_busy` dict shared
+# by several senders, no step limit and a silent `log`. With a SINR `channel` (phy.py),
+# carrier sensing also listens to the nodes currently sending data (`on_air`).
+def advance_simulation(G, transmission_state, current_time, path_busy=None, max_steps=6, log=print,
+                       channel=None, on_air=()):
+    if path_busy is None:
+        path_busy = transmission_state['path_busy']
+    metrics = transmission_state['metrics']
+    step = transmission_state['step']
 
     # Handle backoff state
     if transmission_state['stage'] == 'backoff':
-        elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
+        elapsed_time = (current_time - transmission_state['backoff_start']).total_seconds()
         if elapsed_time >= transmission_state['backoff_time']:
-            print(f"Backoff time completed. Node {transmission_state['waiting_nodes'][0]} retrying transmission.")
+            log(f"Backoff time completed. Node {transmission_state['waiting_nodes'][0]} retrying transmission.")
             transmission_state['collision'] = False
             transmission_state['stage'] = 'carrier_sensing'
-        return create_figure(transmission_state['paths'], step, current_time, transmission_state['waiting_nodes'], transmission_state['collision'])
+        return
 
-    # Only simulate communication steps up to 6 times
-    if step < 6:
+    # Only simulate communication steps up to `max_steps` times
+    if max_steps is None or step < max_steps:
         if transmission_state['start_time'] is None or (current_time - transmission_state['start_time']).total_seconds() >= 50:
             if not transmission_state['waiting_nodes']:
                 # Add new nodes to the waiting list if it's empty
@@ -150,79 +190,136 @@ def update_graph(n):
                 if available_nodes:
                     source = random.choice(available_nodes)
                     target = random.choice(list(set(G.nodes()) - {source}))
-                    path = simulate_communication(G, source, target)
+                    path = simulate_communication(G, source, target, log)
                     if path:
                         transmission_state['paths'] = [path]
                         transmission_state['start_time'] = current_time
+                        transmission_state['request_time'] = current_time
                         transmission_state['step'] += 1
                         transmission_state['stage'] = 'carrier_sensing'
                         transmission_state['waiting_nodes'].append(source)
                 else:
-                    print("No available nodes to send data. Waiting...")
+                    log("No available nodes to send data. Waiting...")
             else:
-                print(f"Node {transmission_state['waiting_nodes'][0]} waiting to transmit.")
+                log(f"Node {transmission_state['waiting_nodes'][0]} waiting to transmit.")
 
     # CSMA/CD protocol stages
     if transmission_state['stage'] == 'carrier_sensing':
         path = transmission_state['paths'][0]
         path_key = tuple(path)
-        if path_key not in path_busy or not path_busy[path_key]:
-            path_busy[path_key] = True
-            print(f"Node {path[0]} detected that the channel is clear. Proceeding to request.")
+        # Carrier sensing only listens; the path is taken in the request stage
+        sensed_busy = channel is not None and channel.channel_busy(on_air, path[0])
+        if not path_busy.get(path_key) and not sensed_busy:
+            log(f"Node {path[0]} detected that the channel is clear. Proceeding to request.")
             transmission_state['stage'] = 'request'
         else:
-            print(f"Collision detected on path {path}. Node {path[0]} will backoff.")
+            log(f"Collision detected on path {path}. Node {path[0]} will backoff.")
             transmission_state['collision'] = True
             transmission_state['backoff_time'] = random.randint(1, 10)
+            transmission_state['backoff_start'] = current_time
             transmission_state['stage'] = 'backoff'
+            metrics['backoffs'] += 1
 
     elif transmission_state['stage'] == 'request':
         path = transmission_state['paths'][0]
-        with transmission_lock:
-            path_key = tuple(path)
-            if not path_busy[path_key]:
-                path_busy[path_key] = True
-                path_str = ' -> '.join(map(str, path))
-                print(f"Node {path[0]} is requesting communication with Node {path[-1]} via path: {path_str}")
-                transmission_state['stage'] = 'acknowledgment'
-            else:
-                print(f"Collision detected on path {path}.")
-                transmission_state['collision'] = True
-                transmission_state['backoff_time'] = random.randint(1, 10)
-                transmission_state['stage'] = 'backoff'
+        path_key = tuple(path)
+        if not path_busy.get(path_key):
+            path_busy[path_key] = True
+            path_str = ' -> '.join(map(str, path))
+            log(f"Node {path[0]} is requesting communication with Node {path[-1]} via path: {path_str}")
+            transmission_state['start_time'] = current_time
+            transmission_state['stage'] = 'acknowledgment'
+        else:
+            log(f"Collision detected on path {path}.")
+            transmission_state['collision'] = True
+            transmission_state['backoff_time'] = random.randint(1, 10)
+            transmission_state['backoff_start'] = current_time
+            transmission_state['stage'] = 'backoff'
+            metrics['collisions'] += 1
+            metrics['backoffs'] += 1
 
     elif transmission_state['stage'] == 'acknowledgment':
         elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
         if elapsed_time >= 10:  # Wait for 10 seconds to simulate acknowledgment
             path = transmission_state['paths'][0]
             path_str = ' -> '.join(map(str, path))
-            print(f"Receiver Node {path[-1]} has granted acknowledgment to Sender Node {path[0]} via path: {path_str}")
+            log(f"Receiver Node {path[-1]} has granted acknowledgment to Sender Node {path[0]} via path: {path_str}")
             transmission_state['stage'] = 'data_transfer'
+            metrics['handshakes'] += 1
+            metrics['handshake_latency'] += (current_time - transmission_state['request_time']).total_seconds()
 
     elif transmission_state['stage'] == 'data_transfer':
         elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
         if elapsed_time >= 20:  # Wait for 20 seconds to simulate data transfer
             path = transmission_state['paths'][0]
             path_str = ' -> '.join(map(str, path))
-            print(f"Data transfer from Sender Node {path[0]} to Receiver Node {path[-1]} via path: {path_str}")
-            print("Data transfer successful.")
-            print("Releasing nodes and medium.")
+            log(f"Data transfer from Sender Node {path[0]} to Receiver Node {path[-1]} via path: {path_str}")
+            log("Data transfer successful.")
+            log("Releasing nodes and medium.")
             path_key = tuple(path)
             path_busy[path_key] = False
             transmission_state['waiting_nodes'].popleft()
             transmission_state['stage'] = 'idle'
             transmission_state['collision'] = False
+            metrics['transfers'] += 1
 
-    return create_figure(transmission_state['paths'], step, current_time, transmission_state['waiting_nodes'], transmission_state['collision'])
+# All senders in the data transfer stage transmit at the same time. One batched SINR
+# evaluation decides which first-hop receptions fail; those senders collide and back off.
+def resolve_collisions(channel, transmission_states, current_time, path_busy=None, log=print):
+    sending = [state for state in transmission_states if state['stage'] == 'data_transfer']
+    if not sending:
+        return
+    transmitters = [state['paths'][0][0] for state in sending]
+    receivers = [state['paths'][0][1] for state in sending]
+    received = channel.receive(transmitters, receivers)
+    for state, ok in zip(sending, received):
+        if ok:
+            continue
+        path = state['paths'][0]
+        log(f"Collision detected on path {path}: Node {path[1]} could not decode Node {path[0]}. Node {path[0]} will backoff.")
+        busy = state['path_busy'] if path_busy is None else path_busy
+        busy[tuple(path)] = False
+        state['collision'] = True
+        state['backoff_time'] = random.randint(1, 10)
+        state['backoff_start'] = current_time
+        state['stage'] = 'backoff'
+        state['metrics']['collisions'] += 1
+        state['metrics']['backoffs'] += 1
 
 # Function to simulate communication steps
-def simulate_communication(G, source, target):
+def simulate_communication(G, source, target, log=print):
     if nx.has_path(G, source, target):
         path = nx.shortest_path(G, source, target)
         return path
     else:
-        print(f"No path found from Node {source} to Node {target}")
+        log(f"No path found from Node {source} to Node {target}")
         return []
 
+# Initialize Dash app (dash is only imported when the app is needed)
+def create_app():
+    import dash
+    from dash.dependencies import Input, Output, State
+
+    app = dash.Dash(__name__)
+    app.layout = serve_layout
+    app.callback(
+        Output('network-graph', 'figure'),
+        [Input('interval-component', 'n_intervals')],
+        [State('session-id', 'data')]
+    )(update_graph)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `app` and `server` (used by WSGI servers such as gunicorn) are created on first access
+    global _app
+    if name in ('app', 'server'):
+        if _app is None:
+            _app = create_app()
+        return _app if name == 'app' else _app.server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     app.run_server(debug=True)
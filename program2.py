@@ -16,45 +16,66 @@ the details of each stage to the console.
 """
 
 import networkx as nx
-import plotly.graph_objects as go
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output
 import random
 import time
 from datetime import datetime, timedelta
-
-# Create a graph for the wireless sensor network
-G = nx.Graph()
+from session_store import get_store, new_session_id
+from layout_cache import get_layout
 
 # Number of nodes
 num_nodes = 8
 
-# Add nodes to the graph
-nodes = range(num_nodes)
-G.add_nodes_from(nodes)
-
-# Randomly add edges between nodes to simulate wireless connections
-edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() > 0.5]
-G.add_edges_from(edges)
-
-# Assign positions to nodes for visualization
-pos = nx.spring_layout(G)
-
-# Initialize Dash app
-app = dash.Dash(__name__)
-
-# State to track the transmission
-transmission_state = {
-    'step': 0,
-    'paths': [],
-    'start_time': None,
-    'stage': 'idle'  # Track the current stage of communication
-}
+# Create a graph for the wireless sensor network
+def build_graph(num_nodes, edge_prob=0.5):
+    G = nx.Graph()
+
+    # Add nodes to the graph
+    nodes = range(num_nodes)
+    G.add_nodes_from(nodes)
+
+    # Randomly add edges between nodes to simulate wireless connections
+    edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() < edge_prob]
+    G.add_edges_from(edges)
+    return G
+
+# State to track the transmission of one sender
+def new_simulation_state():
+    return {
+        'step': 0,
+        'paths': [],
+        'start_time': None,
+        'stage': 'idle',  # Track the current stage of communication
+        'metrics': {
+            'transfers': 0,
+            'collisions': 0,
+            'backoffs': 0,
+            'handshakes': 0,
+            'handshake_latency': 0.0  # Total seconds from request to acknowledgment
+        }
+    }
+
+# State of one session (one browser tab): its own topology and sender
+def new_transmission_state():
+    G = build_graph(num_nodes)
+    transmission_state = new_simulation_state()
+    transmission_state['nodes'] = list(G.nodes())
+    transmission_state['edges'] = list(G.edges())
+    return transmission_state
+
+def session_graph(transmission_state):
+    G = nx.Graph()
+    G.add_nodes_from(transmission_state['nodes'])
+    G.add_edges_from(transmission_state['edges'])
+    return G
 
 # Function to generate Plotly figure
-def create_figure(paths, step, current_time):
+def create_figure(G, transmission_state, current_time):
+    import plotly.graph_objects as go
+
+    # Assign positions to nodes for visualization
+    pos = get_layout(G)
+    paths = transmission_state['paths']
+    step = transmission_state['step']
     edge_trace = []
     for edge in G.edges():
         x0, y0 = pos[edge[0]]
@@ -120,30 +141,41 @@ def create_figure(paths, step, current_time):
 
     return fig
 
-# App layout
-app.layout = html.Div([
-    dcc.Graph(id='network-graph'),
-    dcc.Interval(
-        id='interval-component',
-        interval=1*1000,  # Update every second
-        n_intervals=0
-    )
-])
-
-@app.callback(
-    Output('network-graph', 'figure'),
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n):
-    global transmission_state
-    step = transmission_state['step']
+# App layout, rebuilt on every page load so each tab gets its own session ID
+def serve_layout():
+    from dash import dcc, html
+
+    return html.Div([
+        dcc.Store(id='session-id', data=new_session_id()),
+        dcc.Graph(id='network-graph'),
+        dcc.Interval(
+            id='interval-component',
+            interval=1*1000,  # Update every second
+            n_intervals=0
+        )
+    ])
+
+def update_graph(n, session_id):
+    with get_store().transaction(session_id, new_transmission_state) as transmission_state:
+        G = session_graph(transmission_state)
+        return simulate_step(G, transmission_state)
+
+def simulate_step(G, transmission_state):
     current_time = datetime.now()
+    advance_simulation(G, transmission_state, current_time)
+    return create_figure(G, transmission_state, current_time)
 
-    # Only simulate communication steps up to 3 times
-    if step < 6:
+# Advance the 3-step communication of one sender to `current_time`.
+# The headless runner (mac_cli.py) passes a simulated clock, no step limit and a silent `log`.
+def advance_simulation(G, transmission_state, current_time, max_steps=6, log=print):
+    metrics = transmission_state['metrics']
+    step = transmission_state['step']
+
+    # Only simulate communication steps up to `max_steps` times
+    if max_steps is None or step < max_steps:
         if transmission_state['start_time'] is None or (current_time - transmission_state['start_time']).total_seconds() >= 50:
-            source, target = random.sample(nodes, 2)
-            path = simulate_communication(G, source, target)
+            source, target = random.sample(list(G.nodes()), 2)
+            path = simulate_communication(G, source, target, log)
             if path:
                 transmission_state['paths'] = [path]  # Ensure paths is a list of paths
                 transmission_state['start_time'] = current_time
@@ -154,34 +186,61 @@ def update_graph(n):
     if transmission_state['stage'] == 'request':
         path = transmission_state['paths'][0]
         path_str = ' -> '.join(map(str, path))
-        print(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {path_str}")
+        log(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {path_str}")
         transmission_state['stage'] = 'acknowledgment'
     elif transmission_state['stage'] == 'acknowledgment':
         elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
         if elapsed_time >= 10:  # Wait for 10 seconds to simulate acknowledgment
             path = transmission_state['paths'][0]
             path_str = ' -> '.join(map(str, path))
-            print(f"Receiver Node {path[-1]} has granted acknowledgment to Sender Node {path[0]} via path: {path_str}")
+            log(f"Receiver Node {path[-1]} has granted acknowledgment to Sender Node {path[0]} via path: {path_str}")
             transmission_state['stage'] = 'data_transfer'
+            metrics['handshakes'] += 1
+            metrics['handshake_latency'] += elapsed_time
     elif transmission_state['stage'] == 'data_transfer':
         elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
         if elapsed_time >= 20:  # Wait for 20 seconds to simulate data transfer
             path = transmission_state['paths'][0]
             path_str = ' -> '.join(map(str, path))
-            print(f"Data transfer from Sender Node {path[0]} to Receiver Node {path[-1]} via path: {path_str}")
-            print("      ")
+            log(f"Data transfer from Sender Node {path[0]} to Receiver Node {path[-1]} via path: {path_str}")
+            log("      ")
             transmission_state['stage'] = 'idle'
-    
-    return create_figure(transmission_state['paths'], step, current_time)
+            metrics['transfers'] += 1
 
 # Function to simulate communication steps
-def simulate_communication(G, source, target):
+def simulate_communication(G, source, target, log=print):
     if nx.has_path(G, source, target):
         path = nx.shortest_path(G, source, target)
         return path
     else:
-        print(f"No path found from Node {source} to Node {target}")
+        log(f"No path found from Node {source} to Node {target}")
         return []
 
+# Initialize Dash app (dash is only imported when the app is needed)
+def create_app():
+    import dash
+    from dash.dependencies import Input, Output, State
+
+    app = dash.Dash(__name__)
+    app.layout = serve_layout
+    app.callback(
+        Output('network-graph', 'figure'),
+        [Input('interval-component', 'n_intervals')],
+        [State('session-id', 'data')]
+    )(update_graph)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `app` and `server` (used by WSGI servers such as gunicorn) are created on first access
+    global _app
+    if name in ('app', 'server'):
+        if _app is None:
+            _app = create_app()
+        return _app if name == 'app' else _app.server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     app.run_server(debug=True)
@@ -1,48 +1,73 @@
 import networkx as nx
-import plotly.graph_objects as go
-import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
 import random
 from datetime import datetime, timedelta
 import logging
+from session_store import get_store, new_session_id
+from layout_cache import get_layout
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
-# Create a graph for the wireless sensor network
-G = nx.Graph()
-
 # Number of nodes
 num_nodes = 8
 
-# Add nodes to the graph
-nodes = range(num_nodes)
-G.add_nodes_from(nodes)
+# Create a graph for the wireless sensor network
+def build_graph(num_nodes, edge_prob=0.5):
+    G = nx.Graph()
+
+    # Add nodes to the graph
+    nodes = range(num_nodes)
+    G.add_nodes_from(nodes)
 
-# Randomly add edges between nodes to simulate wireless connections
-edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() > 0.5]
-G.add_edges_from(edges)
+    # Randomly add edges between nodes to simulate wireless connections
+    edges = [(i, j) for i in nodes for j in nodes if i < j and random.random() < edge_prob]
+    G.add_edges_from(edges)
+    return G
 
-# Assign positions to nodes for visualization
-pos = nx.spring_layout(G)
+# State to track the transmission of one sender
+def new_simulation_state():
+    return {
+        'step': 0,
+        'paths': [],
+        'start_time': None,
+        'current_slot': 0,
+        'slot_duration': 50,  # Duration of each TDMA slot in seconds
+        'frequency_bands': ['2.4GHz', '2.5GHz'],
+        'last_update': datetime.now(),
+        'slot_link': None,  # (sender, next hop, band or None for TDMA) sent in the current update
+        'metrics': {
+            'transfers': 0,
+            'tdma_transfers': 0,
+            'fdma_transfers': 0,
+            'collisions': 0,
+            'backoffs': 0,
+            'handshakes': 0,  # TDMA and FDMA transfers have no handshake
+            'handshake_latency': 0.0
+        }
+    }
 
-# Initialize Dash app
-app = dash.Dash(__name__)
+# State of one session (one browser tab): its own topology and sender
+def new_transmission_state():
+    G = build_graph(num_nodes)
+    transmission_state = new_simulation_state()
+    transmission_state['nodes'] = list(G.nodes())
+    transmission_state['edges'] = list(G.edges())
+    return transmission_state
 
-# State to track the transmission
-transmission_state = {
-    'step': 0,
-    'paths': [],
-    'start_time': None,
-    'current_slot': 0,
-    'slot_duration': 50,  # Duration of each TDMA slot in seconds
-    'frequency_bands': ['2.4GHz', '2.5GHz'],
-    'last_update': datetime.now()
-}
+def session_graph(transmission_state):
+    G = nx.Graph()
+    G.add_nodes_from(transmission_state['nodes'])
+    G.add_edges_from(transmission_state['edges'])
+    return G
 
 # Function to generate Plotly figure
-def create_figure(paths, step, current_time):
+def create_figure(G, transmission_state, current_time):
+    import plotly.graph_objects as go
+
+    # Assign positions to nodes for visualization
+    pos = get_layout(G)
+    paths = transmission_state['paths']
+    step = transmission_state['step']
     edge_trace = []
     for edge in G.edges():
         x0, y0 = pos[edge[0]]
@@ -108,77 +133,146 @@ def create_figure(paths, step, current_time):
 
     return fig
 
-# App layout
-app.layout = html.Div([
-    dcc.Graph(id='network-graph'),
-    dcc.Interval(
-        id='interval-component',
-        interval=1*1000,  # Update every second
-        n_intervals=0
-    )
-])
+# App layout, rebuilt on every page load so each tab gets its own session ID
+def serve_layout():
+    from dash import dcc, html
+
+    return html.Div([
+        dcc.Store(id='session-id', data=new_session_id()),
+        dcc.Graph(id='network-graph'),
+        dcc.Interval(
+            id='interval-component',
+            interval=1*1000,  # Update every second
+            n_intervals=0
+        )
+    ])
 
-@app.callback(
-    Output('network-graph', 'figure'),
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n):
-    global transmission_state
+def update_graph(n, session_id):
+    with get_store().transaction(session_id, new_transmission_state) as transmission_state:
+        G = session_graph(transmission_state)
+        return simulate_step(G, transmission_state)
 
+def simulate_step(G, transmission_state):
     # Update the current time
     current_time = datetime.now()
-    
+    advance_simulation(G, transmission_state, current_time)
+    return create_figure(G, transmission_state, current_time)
+
+# Advance the TDMA/FDMA slots of one sender to `current_time`.
+# The headless runner (mac_cli.py) passes a simulated clock and a silent `log`;
+# `max_steps` limits the number of slots (no limit by default).
+def advance_simulation(G, transmission_state, current_time, max_steps=None, log=print):
+    metrics = transmission_state['metrics']
+    transmission_state['slot_link'] = None
+
     # Check if it's time to switch TDMA slot
     if transmission_state['start_time'] is None:
         transmission_state['start_time'] = current_time
 
     elapsed_time = (current_time - transmission_state['start_time']).total_seconds()
-    if elapsed_time >= transmission_state['slot_duration']:
+    if elapsed_time >= transmission_state['slot_duration'] and (max_steps is None or transmission_state['step'] < max_steps):
         transmission_state['step'] += 1
         transmission_state['start_time'] = current_time
         transmission_state['current_slot'] += 1
         if transmission_state['step'] % 2 == 0:
             # Simulate TDMA communication
-            source, target = random.sample(nodes, 2)
-            path = simulate_tdma_communication(G, source, target)
+            source, target = random.sample(list(G.nodes()), 2)
+            path = simulate_tdma_communication(G, source, target, log)
         else:
             # Simulate FDMA communication
-            source, target = random.sample(nodes, 2)
-            path = simulate_fdma_communication(G, source, target)
+            source, target = random.sample(list(G.nodes()), 2)
+            path = simulate_fdma_communication(G, source, target, log)
         
         if path:
             transmission_state['paths'] = [path]
+            metrics['transfers'] += 1
             fdma_band = transmission_state['frequency_bands'][transmission_state['current_slot'] % len(transmission_state['frequency_bands'])]
             if transmission_state['step'] % 2 == 0:
                 # Print TDMA communication details
-                print(f"TDMA: Communication between Node {path[0]} and Node {path[-1]} using path: {' -> '.join(map(str, path))}")
-                print(f"TDMA Slot: {transmission_state['current_slot']}")
-                print(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {' -> '.join(map(str, path))}")
+                metrics['tdma_transfers'] += 1
+                transmission_state['slot_link'] = (path[0], path[1], None)
+                log(f"TDMA: Communication between Node {path[0]} and Node {path[-1]} using path: {' -> '.join(map(str, path))}")
+                log(f"TDMA Slot: {transmission_state['current_slot']}")
+                log(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {' -> '.join(map(str, path))}")
             else:
                 # Print FDMA communication details
-                print(f"FDMA: Communication between Node {path[0]} and Node {path[-1]} using path: {' -> '.join(map(str, path))}")
-                print(f"FDMA Frequency Band: {fdma_band}")
-                print(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {' -> '.join(map(str, path))}")
+                metrics['fdma_transfers'] += 1
+                transmission_state['slot_link'] = (path[0], path[1], fdma_band)
+                log(f"FDMA: Communication between Node {path[0]} and Node {path[-1]} using path: {' -> '.join(map(str, path))}")
+                log(f"FDMA Frequency Band: {fdma_band}")
+                log(f"Sender Node {path[0]} is requesting communication with Receiver Node {path[-1]} via path: {' -> '.join(map(str, path))}")
 
-    return create_figure(transmission_state['paths'], transmission_state['step'], current_time)
+# Physical layer check of the transmissions started in this update, in one batched SINR
+# evaluation. Every TDMA sender owns its own time slot, so TDMA transmissions never overlap;
+# FDMA transmissions on the same frequency band interfere with each other.
+def resolve_slot(channel, transmission_states, log=print):
+    sending = [state for state in transmission_states if state['slot_link'] is not None]
+    if not sending:
+        return
+    transmitters = [state['slot_link'][0] for state in sending]
+    receivers = [state['slot_link'][1] for state in sending]
+    channels = []
+    bands = {}
+    for i, state in enumerate(sending):
+        band = state['slot_link'][2]
+        if band is None:
+            channels.append(-1 - i)  # A TDMA slot of its own
+        else:
+            channels.append(bands.setdefault(band, len(bands)))
+    received = channel.receive(transmitters, receivers, channels)
+    for state, ok in zip(sending, received):
+        if ok:
+            continue
+        sender, receiver, band = state['slot_link']
+        mode = 'tdma' if band is None else 'fdma'
+        log(f"{mode.upper()}: Node {receiver} could not decode Node {sender}, the slot is lost")
+        state['metrics']['transfers'] -= 1
+        state['metrics'][f'{mode}_transfers'] -= 1
+        state['metrics']['collisions'] += 1
 
 # Function to simulate TDMA communication steps
-def simulate_tdma_communication(G, source, target):
+def simulate_tdma_communication(G, source, target, log=print):
     if nx.has_path(G, source, target):
         path = nx.shortest_path(G, source, target)
         return path
     else:
-        print(f"No path found from Node {source} to Node {target}")
+        log(f"No path found from Node {source} to Node {target}")
         return []
 
 # Function to simulate FDMA communication steps
-def simulate_fdma_communication(G, source, target):
+def simulate_fdma_communication(G, source, target, log=print):
     if nx.has_path(G, source, target):
         path = nx.shortest_path(G, source, target)
         return path
     else:
-        print(f"No path found from Node {source} to Node {target}")
+        log(f"No path found from Node {source} to Node {target}")
         return []
 
+# Initialize Dash app (dash is only imported when the app is needed)
+def create_app():
+    import dash
+    from dash.dependencies import Input, Output, State
+
+    app = dash.Dash(__name__)
+    app.layout = serve_layout
+    app.callback(
+        Output('network-graph', 'figure'),
+        [Input('interval-component', 'n_intervals')],
+        [State('session-id', 'data')]
+    )(update_graph)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `app` and `server` (used by WSGI servers such as gunicorn) are created on first access
+    global _app
+    if name in ('app', 'server'):
+        if _app is None:
+            _app = create_app()
+        return _app if name == 'app' else _app.server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     app.run_server(debug=True)
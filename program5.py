@@ -1,6 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import networkx as nx
+from phy import SinrChannel
+from results_store import open_results_store
 
 # Define constants
 NB_NODES = 20  # Total number of nodes
@@ -9,6 +9,7 @@ SIMULATION_ROUNDS = 6  # Number of rounds
 DATA_AGGREGATION_COST = 0.1  # Cost of data aggregation (arbitrary units)
 SLEEP_MODE_COST = 0.05  # Cost of being in sleep mode (arbitrary units)
 ACTIVE_MODE_COST = 0.2  # Cost of being in active mode (arbitrary units)
+BASE_STATIONS = {'BSID': (50, 50)}  # Base station id -> position; cluster heads use the nearest one
 
 class Node:
     def __init__(self, node_id, x, y):
@@ -23,6 +24,9 @@ class Node:
     def distance_to(self, other_node):
         return np.sqrt((self.x - other_node.x) ** 2 + (self.y - other_node.y) ** 2)
 
+    def nearest_base_station(self):
+        return min(BASE_STATIONS, key=lambda bs: (self.x - BASE_STATIONS[bs][0]) ** 2 + (self.y - BASE_STATIONS[bs][1]) ** 2)
+
     def consume_energy(self, mode):
         if mode == 'ACTIVE':
             self.energy -= ACTIVE_MODE_COST
@@ -65,7 +69,7 @@ def leach_setup_phase(network):
         node = alive_nodes[idx]
         if np.random.uniform(0, 1) < prob_ch:
             node.is_cluster_head = True
-            node.next_hop = 'BSID'  # Base Station ID
+            node.next_hop = node.nearest_base_station()
             heads.append(node)
         idx = (idx + 1) % len(alive_nodes)
 
@@ -84,8 +88,51 @@ def leach_setup_phase(network):
             node.state = 'SLEEP'
 
     network.broadcast_next_hop()
+    return heads
+
+def base_station_load(network, heads):
+    # Cluster heads and member nodes served by each base station
+    load = {bs: {'heads': 0, 'members': 0} for bs in BASE_STATIONS}
+    for head in heads:
+        load[head.next_hop]['heads'] += 1
+    for node in network.get_alive_nodes():
+        if not node.is_cluster_head and node.next_hop is not None:
+            head = network.nodes[node.next_hop]
+            if head.next_hop in load:
+                load[head.next_hop]['members'] += 1
+    for bs, counts in load.items():
+        print(f"Base station {bs}: {counts['heads']} cluster heads, {counts['members']} member nodes")
+    return load
+
+def leach_steady_state(network, channel):
+    # Members send their data to their cluster head in TDMA slots. In slot k the k-th
+    # member of every cluster transmits, so clusters interfere with each other; each
+    # slot is decided by one batched SINR evaluation.
+    clusters = {}
+    for node in network.get_alive_nodes():
+        if not node.is_cluster_head and node.next_hop is not None:
+            clusters.setdefault(node.next_hop, []).append(node.node_id)
+    delivered = 0
+    lost = 0
+    slots = max((len(members) for members in clusters.values()), default=0)
+    for slot in range(slots):
+        transmitters = []
+        receivers = []
+        for head, members in clusters.items():
+            if slot < len(members):
+                transmitters.append(members[slot])
+                receivers.append(head)
+        received = channel.receive(transmitters, receivers)
+        delivered += int(received.sum())
+        lost += len(received) - int(received.sum())
+    print(f'Steady state: {delivered} packets received by cluster heads, {lost} lost in {slots} slots')
+    return delivered, lost
 
 def plot_network(nodes):
+    # Plotting libraries are only loaded when a plot is drawn
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     G = nx.Graph()
     pos = {node.node_id: (node.x, node.y) for node in nodes}
 
@@ -95,7 +142,7 @@ def plot_network(nodes):
 
     # Add edges based on next_hop
     for node in nodes:
-        if node.next_hop != 'BSID' and node.next_hop in G.nodes:
+        if node.next_hop not in BASE_STATIONS and node.next_hop in G.nodes:
             G.add_edge(node.node_id, node.next_hop)
 
     # Draw the network
@@ -106,7 +153,32 @@ def plot_network(nodes):
     plt.show()
 
 # Main execution
-network = Network()
-for _ in range(SIMULATION_ROUNDS):
-    leach_setup_phase(network)
-    plot_network(network.get_alive_nodes())
+if __name__ == '__main__':
+    network = Network()
+    # Node positions do not change, so the path losses are computed once
+    channel = SinrChannel({node.node_id: (node.x, node.y) for node in network.nodes})
+    # Rounds are recorded when WSN_RESULTS_DB names a results database
+    store = open_results_store()
+    if store:
+        run_id = store.start_run('leach', {'nodes': NB_NODES, 'clusters': NB_CLUSTERS, 'rounds': SIMULATION_ROUNDS,
+                                           'base_stations': BASE_STATIONS}, 'LEACH', NB_NODES)
+    total_delivered = total_lost = 0
+    for round_number in range(SIMULATION_ROUNDS):
+        heads = leach_setup_phase(network)
+        delivered, lost = leach_steady_state(network, channel)
+        load = base_station_load(network, heads)
+        total_delivered += delivered
+        total_lost += lost
+        if store:
+            metrics = {'delivered': delivered, 'lost': lost, 'heads': len(heads),
+                       'alive_nodes': len(network.get_alive_nodes()),
+                       'total_energy': float(sum(node.energy for node in network.nodes))}
+            for bs, counts in load.items():
+                metrics[f'{bs}_heads'] = counts['heads']
+                metrics[f'{bs}_members'] = counts['members']
+            store.add_metrics(run_id, round_number, metrics)
+        plot_network(network.get_alive_nodes())
+    if store:
+        store.finish_run(run_id, {'delivered': total_delivered, 'lost': total_lost,
+                                  'alive_nodes': len(network.get_alive_nodes())})
+        store.close()
@@ -0,0 +1,173 @@
+"""
+SQLite store for simulation results
+
+Every run (Program-4/cli.py, the LEACH rounds of program5.py, mac_cli.py) gets a
+row in `runs` with its parameters and final summary. Per-step (or per-round)
+metrics go to `metrics`, one row per metric, and delivered data packets to
+`packets`. Rows are buffered and written with `executemany` in one transaction
+per batch, so recording a run costs little more than appending to a list.
+
+The database is a single file, `results.db` by default or the path in the
+WSN_RESULTS_DB environment variable. Runs can be listed with
+`python results_store.py list --protocol AODV --nodes 500`, or queried directly:
+
+    SELECT protocol, nodes, AVG(json_extract(summary, '$.delivered'))
+    FROM runs GROUP BY protocol, nodes;
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+DEFAULT_PATH = 'results.db'
+DEFAULT_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    program TEXT NOT NULL,
+    protocol TEXT,
+    nodes INTEGER,
+    seed INTEGER,
+    started_at TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_protocol_nodes ON runs (protocol, nodes);
+CREATE INDEX IF NOT EXISTS runs_nodes ON runs (nodes);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    step INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_run_step ON metrics (run_id, step);
+
+CREATE TABLE IF NOT EXISTS packets (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    source INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    hops INTEGER,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS packets_run ON packets (run_id);
+"""
+
+
+class ResultsStore:
+    def __init__(self, path=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path or os.environ.get('WSN_RESULTS_DB', DEFAULT_PATH)
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(self.path)
+        # The write-ahead log lets readers query while a simulation writes, and
+        # synchronous=NORMAL skips the fsync of every commit
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.pending_metrics = []
+        self.pending_packets = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start_run(self, program, parameters, protocol=None, nodes=None, seed=None):
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (program, protocol, nodes, seed, started_at, parameters) VALUES (?, ?, ?, ?, ?, ?)',
+                (program, protocol, nodes, seed, datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(parameters, default=str)))
+        return cursor.lastrowid
+
+    def add_metrics(self, run_id, step, metrics):
+        # Only numeric values are kept: one row per (step, metric name)
+        self.pending_metrics.extend((run_id, step, name, value) for name, value in metrics.items()
+                                    if isinstance(value, (int, float)) or value is None)
+        if len(self.pending_metrics) >= self.batch_size:
+            self.flush()
+
+    def add_packets(self, run_id, records):
+        # records: (source id, seq, hop count, latency) of each delivered packet
+        self.pending_packets.extend((run_id, *record) for record in records)
+        if len(self.pending_packets) >= self.batch_size:
+            self.flush()
+
+    def finish_run(self, run_id, summary):
+        self.flush()
+        with self.connection:
+            self.connection.execute('UPDATE runs SET summary = ? WHERE run_id = ?',
+                                    (json.dumps(summary, default=str), run_id))
+
+    def flush(self):
+        if not self.pending_metrics and not self.pending_packets:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?)', self.pending_metrics)
+            self.connection.executemany('INSERT INTO packets VALUES (?, ?, ?, ?, ?)', self.pending_packets)
+        self.pending_metrics = []
+        self.pending_packets = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def runs(self, program=None, protocol=None, nodes=None, limit=None):
+        query = 'SELECT run_id, program, protocol, nodes, seed, started_at, parameters, summary FROM runs'
+        conditions = []
+        values = []
+        for column, value in (('program', program), ('protocol', protocol), ('nodes', nodes)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                values.append(value)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY run_id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            values.append(limit)
+        return [
+            {'run_id': run_id, 'program': program, 'protocol': protocol, 'nodes': nodes, 'seed': seed,
+             'started_at': started_at, 'parameters': json.loads(parameters),
+             'summary': json.loads(summary) if summary else None}
+            for run_id, program, protocol, nodes, seed, started_at, parameters, summary
+            in self.connection.execute(query, values)
+        ]
+
+    def metrics(self, run_id):
+        # {metric name: [(step, value), ...]} of one run
+        series = {}
+        for step, name, value in self.connection.execute(
+                'SELECT step, name, value FROM metrics WHERE run_id = ? ORDER BY step', (run_id,)):
+            series.setdefault(name, []).append((step, value))
+        return series
+
+
+def open_results_store():
+    # The store named by WSN_RESULTS_DB, or None when results are not recorded
+    path = os.environ.get('WSN_RESULTS_DB')
+    return ResultsStore(path) if path else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the simulation results database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help='Print the recorded runs as JSON lines')
+    list_parser.add_argument('--db', help=f'Database file (default: $WSN_RESULTS_DB or {DEFAULT_PATH})')
+    list_parser.add_argument('--program', help='Only runs of this program (cli, leach, mac_cli)')
+    list_parser.add_argument('--protocol', help='Only runs of this protocol')
+    list_parser.add_argument('--nodes', type=int, help='Only runs with this many nodes')
+    list_parser.add_argument('--limit', type=int, help='Print at most this many runs')
+    args = parser.parse_args(argv)
+
+    with ResultsStore(args.db) as store:
+        for run in store.runs(args.program, args.protocol, args.nodes, args.limit):
+            print(json.dumps(run))
+
+
+if __name__ == '__main__':
+    main()
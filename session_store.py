@@ -0,0 +1,238 @@
+"""
+Per-session simulation state for the Dash programs
+
+Each browser tab gets its own session ID and its own simulation state. The
+state lives in a session store instead of module globals, so the programs can
+be served by several worker processes (for example `gunicorn -w 4 program1:server`).
+
+Two stores are available:
+1. LocalSessionStore: in-process, used when a single server process is enough.
+2. SharedSessionStore: a client for a local key-value server started with
+   `python session_store.py serve`, shared by every worker process.
+
+Both keep at most `max_sessions` sessions and evict the least recently used one
+when the cache is full. An evicted session simply starts a fresh simulation the
+next time its tab polls the server.
+
+The store is selected with the WSN_SESSION_STORE environment variable:
+unset (local store) or `host:port` of a running session server. The server
+and its workers share the secret in WSN_SESSION_AUTHKEY; when it is unset,
+`serve` generates one and prints it.
+"""
+
+import os
+import secrets
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+
+DEFAULT_MAX_SESSIONS = 256
+DEFAULT_ADDRESS = '127.0.0.1:50550'
+LOCK_STRIPES = 64  # Number of locks shared between all sessions
+LOCK_LEASE = 30  # Seconds a transaction may hold its lock before it is presumed dead
+LOCK_TIMEOUT = 120  # Seconds a transaction waits for its lock
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class SessionTable:
+    """Bounded LRU mapping of session ID -> simulation state."""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            state = self.sessions.get(session_id)
+            if state is not None:
+                self.sessions.move_to_end(session_id)
+            return state
+
+    def set(self, session_id, state):
+        with self._lock:
+            self.sessions[session_id] = state
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self.sessions),
+                    'max_sessions': self.max_sessions,
+                    'evictions': self.evictions}
+
+
+class LocalSessionStore:
+    """Session store held in the memory of the current process."""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.table = SessionTable(max_sessions)
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _lock_for(self, session_id):
+        return self.locks[hash(session_id) % LOCK_STRIPES]
+
+    @contextmanager
+    def transaction(self, session_id, factory):
+        """Yield the state of `session_id` (created with `factory` if missing) and store it back."""
+        with self._lock_for(session_id):
+            state = self.table.get(session_id)
+            if state is None:
+                state = factory()
+            yield state
+            self.table.set(session_id, state)
+
+    def stats(self):
+        return self.table.stats()
+
+
+class LeaseLock:
+    """Lock of the session server that its holder keeps for at most `lease` seconds.
+
+    A worker killed inside a transaction never releases its lock, so once the lease
+    runs out the lock goes to the next waiter. `acquire` returns a token (None on
+    timeout) and only the release with the current token frees the lock.
+    """
+
+    def __init__(self, lease=LOCK_LEASE):
+        self.lease = lease
+        self._condition = threading.Condition()
+        self._acquired_at = None
+        self._token = 0
+
+    def acquire(self, timeout=LOCK_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._acquired_at is not None:
+                now = time.monotonic()
+                expires = self._acquired_at + self.lease
+                if now >= expires:
+                    break
+                if now >= deadline:
+                    return None
+                self._condition.wait(min(expires, deadline) - now)
+            self._token += 1
+            self._acquired_at = time.monotonic()
+            return self._token
+
+    def release(self, token):
+        with self._condition:
+            if token == self._token:
+                self._acquired_at = None
+                self._condition.notify()
+
+
+# Objects hosted by the session server, shared by all connected workers
+_server_table = None
+_server_locks = [LeaseLock() for _ in range(LOCK_STRIPES)]
+
+
+def _get_table():
+    return _server_table
+
+
+def _get_lock(index):
+    return _server_locks[index]
+
+
+class SessionManager(BaseManager):
+    pass
+
+
+SessionManager.register('get_table', callable=_get_table)
+SessionManager.register('get_lock', callable=_get_lock)
+
+
+class SharedSessionStore:
+    """Session store kept in a session server shared by several worker processes."""
+
+    def __init__(self, address, authkey):
+        host, port = address.rsplit(':', 1)
+        self.manager = SessionManager(address=(host, int(port)), authkey=authkey)
+        self.manager.connect()
+        self.table = self.manager.get_table()
+        self.locks = [self.manager.get_lock(i) for i in range(LOCK_STRIPES)]
+
+    def _lock_for(self, session_id):
+        # Stable across processes (unlike hash()); session IDs come from the browser, so
+        # any string has to work
+        return self.locks[zlib.crc32(session_id.encode()) % LOCK_STRIPES]
+
+    @contextmanager
+    def transaction(self, session_id, factory):
+        """Yield the state of `session_id` (created with `factory` if missing) and store it back."""
+        lock = self._lock_for(session_id)
+        token = lock.acquire(LOCK_TIMEOUT)
+        if token is None:
+            raise TimeoutError(f"Session {session_id} stayed locked for {LOCK_TIMEOUT} seconds")
+        try:
+            state = self.table.get(session_id)
+            if state is None:
+                state = factory()
+            yield state
+            self.table.set(session_id, state)
+        finally:
+            lock.release(token)
+
+    def stats(self):
+        return self.table.stats()
+
+
+def serve(address=DEFAULT_ADDRESS, authkey=None, max_sessions=DEFAULT_MAX_SESSIONS):
+    # The server unpickles what its clients send, so it only accepts clients that know
+    # the key; without one a random key is generated for this run
+    global _server_table
+    _server_table = SessionTable(max_sessions)
+    if authkey is None:
+        authkey = secrets.token_hex(16).encode()
+        print(f"WSN_SESSION_AUTHKEY={authkey.decode()}")
+    host, port = address.rsplit(':', 1)
+    manager = SessionManager(address=(host, int(port)), authkey=authkey)
+    server = manager.get_server()
+    print(f"Session server listening on {address} (max {max_sessions} sessions)")
+    server.serve_forever()
+
+
+_store = None
+
+
+def get_store():
+    """Return the session store of this process, selected by WSN_SESSION_STORE."""
+    global _store
+    if _store is None:
+        address = os.environ.get('WSN_SESSION_STORE')
+        authkey = os.environ.get('WSN_SESSION_AUTHKEY')
+        max_sessions = int(os.environ.get('WSN_MAX_SESSIONS', DEFAULT_MAX_SESSIONS))
+        if address:
+            if not authkey:
+                raise RuntimeError("WSN_SESSION_AUTHKEY must be set to the key of the session server")
+            _store = SharedSessionStore(address, authkey.encode())
+        else:
+            _store = LocalSessionStore(max_sessions)
+    return _store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Shared session server for the WSN Dash programs')
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--address', default=os.environ.get('WSN_SESSION_STORE', DEFAULT_ADDRESS))
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS)
+    args = parser.parse_args()
+    authkey = os.environ.get('WSN_SESSION_AUTHKEY')
+    serve(args.address, authkey.encode() if authkey else None, args.max_sessions)